@@ -0,0 +1,119 @@
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+# -*- coding: utf-8 -*-
+"""
+Mail benchmark against a local SMTP stand-in: messages per second, bytes
+on the wire, SMTP connections and peak Python memory of
+send_mime_multipart, for several attachment and batch sizes.
+
+Usage: python benchmarks/bench_mail.py --sizes 0,1024,16384 --batches 1,10,50 --latency 0.001
+
+:copyright: (c) 2020 Paolo Bernardi.
+:license: GNU AGPL version 3, see LICENSE for more details.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "main", "python")
+)
+
+from fake_smtp import FakeSMTP  # noqa: E402
+from server.smtp import SMTP  # noqa: E402
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def make_file(directory: str, name: str, size: int, header: bytes = b"") -> str:
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(header)
+        # Written a MiB at a time, so that big attachments don't skew memory
+        chunk = os.urandom(min(size, 1024 * 1024))
+        written = len(header)
+        while written < size:
+            f.write(chunk[: size - written])
+            written += len(chunk)
+    return path
+
+
+def send(smtp: SMTP, messages) -> float:
+    # Every batch starts with a fresh session, like after idle_timeout
+    smtp.close()
+    start = time.perf_counter()
+    for message in messages:
+        smtp.send_mime_multipart(**message)
+    return time.perf_counter() - start
+
+
+def measure(label: str, fake: FakeSMTP, smtp: SMTP, messages):
+    # tracemalloc slows everything down: the batch is timed on its own,
+    # then sent again to measure the memory
+    fake.reset_counts()
+    elapsed = send(smtp, messages)
+    counts = fake.counts.copy()
+    tracemalloc.start()
+    send(smtp, messages)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{label:<22} {len(messages) / elapsed:9.1f} msg/s"
+        f" {counts['bytes'] / 1024:12.1f} KiB sent"
+        f" {counts['connections']:4d} connections"
+        f" {peak / 1024:10.1f} KiB peak"
+    )
+    if counts["messages"] != len(messages):
+        print(f"  only {counts['messages']} of {len(messages)} messages received")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--sizes", default="0,256,4096", help="attachment sizes in KiB, comma separated"
+    )
+    parser.add_argument(
+        "--batches", default="1,10,50", help="messages per batch, comma separated"
+    )
+    parser.add_argument("--image", type=int, default=8, help="signature image size in KiB")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per SMTP command")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    batches = [int(b) for b in args.batches.split(",")]
+    with tempfile.TemporaryDirectory() as directory, FakeSMTP(args.latency) as fake:
+        smtp = SMTP(
+            fake.host, fake.port, "bench", "bench", "bench@example.com", "<b>Bench</b>"
+        )
+        images = []
+        if args.image:
+            # The PNG signature, for MIMEImage to guess the image type
+            images = [make_file(directory, "logo.png", args.image * 1024, PNG_SIGNATURE)]
+        print(
+            f"{args.image} KiB signature image, {args.latency * 1000:.0f} ms latency"
+            " per SMTP command"
+        )
+        for size in sizes:
+            attachments = []
+            if size:
+                attachments = [make_file(directory, f"attachment-{size}.bin", size * 1024)]
+            for batch in batches:
+                messages = [
+                    {
+                        "to": ["someone@example.com"],
+                        "subject": f"Benchmark message {i + 1}",
+                        "body_html": "<p>Please find attached the benchmark.</p>",
+                        "attachments": attachments,
+                        "images": images,
+                    }
+                    for i in range(batch)
+                ]
+                measure(f"{size:>6} KiB x {batch:<4}", fake, smtp, messages)
+        smtp.close()
+
+
+if __name__ == "__main__":
+    main()
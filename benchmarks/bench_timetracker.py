@@ -0,0 +1,77 @@
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+# -*- coding: utf-8 -*-
+"""
+Timetracker benchmark against a local Jira stand-in: wall time, Jira
+request counts and peak Python memory of get_worklogs and worklogs_to_html.
+
+Usage: python benchmarks/bench_timetracker.py --tickets 50 --worklogs 40 --latency 0.02
+
+:copyright: (c) 2020 Paolo Bernardi.
+:license: GNU AGPL version 3, see LICENSE for more details.
+"""
+
+import argparse
+from datetime import datetime
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "main", "python")
+)
+
+from fake_jira import FakeJira  # noqa: E402
+from organization import Organization  # noqa: E402
+from server.jira import Jira  # noqa: E402
+from service.timetracker import Timetracker  # noqa: E402
+
+
+def measure(label: str, fake: FakeJira, func):
+    fake.reset_counts()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{label:<18} {elapsed * 1000:10.1f} ms {fake.total_requests():8d} requests"
+        f" {peak / 1024:10.1f} KiB peak"
+    )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--tickets", type=int, default=20)
+    parser.add_argument("--worklogs", type=int, default=20, help="worklogs per ticket")
+    parser.add_argument("--users", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds per request")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    users = [f"user{u + 1}" for u in range(args.users)]
+    date = datetime(2020, 6, 1, 9, 0)
+    with FakeJira(args.tickets, args.worklogs, args.latency, users, date) as fake:
+        org = Organization("Benchmark")
+        org.set_jira(Jira(fake.url, "bench", "bench"))
+        helper = {"parameters": {"jira_users": ",".join(users)}}
+        timetracker = Timetracker(org, helper)
+        print(
+            f"{args.tickets} tickets, {args.worklogs} worklogs per ticket,"
+            f" {args.users} users, {args.latency * 1000:.0f} ms latency"
+        )
+        for _ in range(args.repeat):
+            worklogs_by_user = measure(
+                "get_worklogs", fake, lambda: timetracker.get_worklogs(date)
+            )
+            measure(
+                "worklogs_to_html",
+                fake,
+                lambda: timetracker.worklogs_to_html(worklogs_by_user),
+            )
+
+
+if __name__ == "__main__":
+    main()
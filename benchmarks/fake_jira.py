@@ -0,0 +1,141 @@
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+# -*- coding: utf-8 -*-
+"""
+Local Jira stand-in for benchmarks: it answers the few REST endpoints used
+by the Timetracker (JQL search and issue worklogs) with synthetic data.
+
+:copyright: (c) 2020 Paolo Bernardi.
+:license: GNU AGPL version 3, see LICENSE for more details.
+"""
+
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import re
+import threading
+import time
+from typing import Dict, List
+from urllib.parse import urlparse
+
+WORKLOG_PATH = re.compile(r"/rest/api/\d+/issue/([^/]+)/worklog$")
+SEARCH_PATH = re.compile(r"/rest/api/\d+/search(/jql)?$")
+
+
+class FakeJira:
+    """
+    Threaded HTTP server with configurable tickets, worklogs per ticket
+    and per-request latency. Requests are counted by endpoint.
+    """
+
+    tickets: int
+    worklogs_per_ticket: int
+    latency: float
+    users: List[str]
+    date: datetime
+    request_counts: Counter
+    _issues: Dict
+    _worklogs: Dict[str, Dict]
+    _server: ThreadingHTTPServer
+    _thread: threading.Thread
+
+    def __init__(
+        self,
+        tickets: int,
+        worklogs_per_ticket: int,
+        latency: float,
+        users: List[str],
+        date: datetime,
+    ):
+        self.tickets = tickets
+        self.worklogs_per_ticket = worklogs_per_ticket
+        self.latency = latency
+        self.users = users
+        self.date = date
+        self.request_counts = Counter()
+        self._build_data()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def _build_data(self):
+        issues = []
+        self._worklogs = {}
+        for t in range(self.tickets):
+            key = f"BENCH-{t + 1}"
+            issues.append({"key": key, "fields": {"summary": f"Benchmark ticket {t + 1}"}})
+            worklogs = []
+            for w in range(self.worklogs_per_ticket):
+                started = self.date + timedelta(minutes=w)
+                worklogs.append(
+                    {
+                        "self": f"{key}/worklog/{w + 1}",
+                        "updateAuthor": {"displayName": self.users[w % len(self.users)]},
+                        "comment": f"Work <{w}> & notes on {key}",
+                        "started": started.strftime("%Y-%m-%dT%H:%M:%S.000+0000"),
+                        "timeSpentSeconds": 900,
+                    }
+                )
+            self._worklogs[key] = {
+                "startAt": 0,
+                "maxResults": len(worklogs),
+                "total": len(worklogs),
+                "worklogs": worklogs,
+            }
+        self._issues = {
+            "startAt": 0,
+            "maxResults": len(issues),
+            "total": len(issues),
+            "issues": issues,
+        }
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if fake.latency:
+                    time.sleep(fake.latency)
+                match = WORKLOG_PATH.search(path)
+                if SEARCH_PATH.search(path):
+                    fake.request_counts["search"] += 1
+                    self._reply(200, fake._issues)
+                elif match and match.group(1) in fake._worklogs:
+                    fake.request_counts["worklog"] += 1
+                    self._reply(200, fake._worklogs[match.group(1)])
+                else:
+                    fake.request_counts["other"] += 1
+                    self._reply(404, {"errorMessages": [f"Not found: {path}"]})
+
+            def _reply(self, status: int, payload: Dict):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def total_requests(self) -> int:
+        return sum(self.request_counts.values())
+
+    def reset_counts(self):
+        self.request_counts.clear()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,175 @@
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+# -*- coding: utf-8 -*-
+"""
+Local SMTP stand-in for benchmarks: it speaks just enough ESMTP (STARTTLS,
+AUTH PLAIN/LOGIN, MAIL, RCPT, DATA) for server.smtp.SMTP and throws the
+messages away, counting them.
+
+The TLS certificate is a throwaway self-signed one, made by the openssl
+command line tool.
+
+:copyright: (c) 2020 Paolo Bernardi.
+:license: GNU AGPL version 3, see LICENSE for more details.
+"""
+
+from collections import Counter
+import os
+import shutil
+import socketserver
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+
+
+class FakeSMTP:
+    """
+    Threaded SMTP sink with a configurable per-command latency. It counts
+    connections, messages and the bytes received (after TLS decryption).
+    Any user and password are accepted.
+    """
+
+    latency: float
+    counts: Counter
+    _lock: threading.Lock
+    _cert_dir: str
+    _context: ssl.SSLContext
+    _server: socketserver.ThreadingTCPServer
+    _thread: threading.Thread
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        self._cert_dir = tempfile.mkdtemp(prefix="fake-smtp-")
+        self._context = self._tls_context()
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def host(self) -> str:
+        return self._server.server_address[0]
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def _tls_context(self) -> ssl.SSLContext:
+        cert = os.path.join(self._cert_dir, "cert.pem")
+        key = os.path.join(self._cert_dir, "key.pem")
+        subprocess.run(
+            [
+                "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+                "-days", "1", "-subj", "/CN=localhost",
+                "-keyout", key, "-out", cert,
+            ],
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        return context
+
+    def _count(self, name: str, value: int = 1):
+        with self._lock:
+            self.counts[name] += value
+
+    def _handler(self):
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def setup(self):
+                super().setup()
+                self.tls = False
+                self.authenticated = False
+                self.recipients = 0
+
+            def handle(self):
+                fake._count("connections")
+                self._reply("220 localhost Fake ESMTP")
+                while True:
+                    line = self._readline()
+                    if not line:
+                        break
+                    if fake.latency:
+                        time.sleep(fake.latency)
+                    command, _, argument = line.strip().decode("ascii", "replace").partition(" ")
+                    command = command.upper()
+                    if command in ("EHLO", "HELO"):
+                        extension = "AUTH PLAIN LOGIN" if self.tls else "STARTTLS"
+                        self._reply("250-localhost", f"250 {extension}")
+                    elif command == "STARTTLS" and not self.tls:
+                        self._reply("220 Ready to start TLS")
+                        self._start_tls()
+                    elif command == "AUTH" and self.tls:
+                        if argument.upper() == "LOGIN":
+                            self._reply("334 VXNlcm5hbWU6")
+                            self._readline()
+                            self._reply("334 UGFzc3dvcmQ6")
+                            self._readline()
+                        elif argument.upper() == "PLAIN":
+                            self._reply("334 ")
+                            self._readline()
+                        self.authenticated = True
+                        self._reply("235 Authentication successful")
+                    elif command == "MAIL" and self.authenticated:
+                        self.recipients = 0
+                        self._reply("250 OK")
+                    elif command == "RCPT" and self.authenticated:
+                        self.recipients += 1
+                        self._reply("250 OK")
+                    elif command == "DATA" and self.recipients:
+                        self._reply("354 End data with <CR><LF>.<CR><LF>")
+                        self._read_data()
+                        fake._count("messages")
+                        self._reply("250 OK: queued")
+                    elif command in ("RSET", "NOOP"):
+                        self._reply("250 OK")
+                    elif command == "QUIT":
+                        self._reply("221 Bye")
+                        break
+                    else:
+                        self._reply("503 Bad sequence of commands")
+
+            def _readline(self) -> bytes:
+                line = self.rfile.readline()
+                fake._count("bytes", len(line))
+                return line
+
+            def _read_data(self):
+                size = 0
+                while True:
+                    line = self.rfile.readline()
+                    if not line or line == b".\r\n":
+                        break
+                    size += len(line)
+                fake._count("bytes", size + 3)
+                fake._count("data_bytes", size)
+
+            def _reply(self, *lines: str):
+                self.wfile.write("".join(f"{line}\r\n" for line in lines).encode("ascii"))
+                self.wfile.flush()
+
+            def _start_tls(self):
+                self.request = fake._context.wrap_socket(self.request, server_side=True)
+                self.rfile = self.request.makefile("rb")
+                self.wfile = self.request.makefile("wb")
+                self.tls = True
+
+        return Handler
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts.clear()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+        shutil.rmtree(self._cert_dir, ignore_errors=True)
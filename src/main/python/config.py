@@ -7,14 +7,18 @@
 
 import json
 import os
+import re
 from typing import Dict, List, Union
 
 from PyQt5.QtWidgets import QFileDialog, QMessageBox, QApplication
 
 from organization import Organization
 from server.caldav import CalDAV
+from server.jira import Jira
+from server.phabricator import Phabricator
 from server.smtp import SMTP
 from server.ftp import FTP
+from server.storage import LocalStorage, WebDAVStorage
 
 HelperType = Dict[str, Union[str, int, bool, Dict[str, str]]]
 
@@ -65,6 +69,24 @@ class Config:
             org.set_calendar(
                 CalDAV(oj_cal["url"], oj_cal["username"], oj_cal["password"])
             )
+        if "server_jira" in oj:
+            oj_jira = oj["server_jira"]
+            org.set_jira(
+                Jira(oj_jira["url"], oj_jira["username"], oj_jira["password"])
+            )
+        if "server_phabricator" in oj:
+            oj_phab = oj["server_phabricator"]
+            org.set_phabricator(
+                Phabricator(
+                    oj_phab["url"],
+                    oj_phab["user_phid"],
+                    oj_phab["token"],
+                    oj_phab.get("timeout", 60),
+                    oj_phab.get("retries", 3),
+                    oj_phab.get("pool_size", 8),
+                    oj_phab.get("upload_workers", 4),
+                )
+            )
         if "server_smtp" in oj:
             oj_smtp = oj["server_smtp"]
             org.set_smtp(
@@ -75,6 +97,19 @@ class Config:
                     oj_smtp["password"],
                     oj_smtp["default_from_address"],
                     oj_smtp["html_signature"],
+                    oj_smtp.get("idle_timeout", 60),
+                    oj_smtp.get("timeout", 60),
+                )
+            )
+            # Outbound mail queue, delivered in background (opened on first use)
+            queue_name = re.sub(r"\W", "_", name)
+            org.set_mail_queue_file(
+                oj_smtp.get(
+                    "queue_file",
+                    os.path.join(
+                        os.path.expanduser("~"),
+                        f".photocopieuse-mail-{queue_name}.sqlite",
+                    ),
                 )
             )
         if "server_ftp" in oj:
@@ -85,8 +120,36 @@ class Config:
                     oj_ftp["port"],
                     oj_ftp["username"],
                     oj_ftp["password"],
+                    oj_ftp.get("pool_size", 2),
+                    oj_ftp.get("idle_timeout", 120),
+                    oj_ftp.get("keepalive_interval", 15),
+                    oj_ftp.get("listing_cache_ttl", 60),
+                    oj_ftp.get("listing_cache_size", 32),
+                    oj_ftp.get("time_shift"),
                 )
             )
+        # The wiki files are stored on the FTP server unless configured
+        # otherwise, or on the local filesystem when there's no FTP server
+        # (Travels uses this default storage only when configured explicitly)
+        oj_storage = oj.get("server_storage", {})
+        explicit = "server_storage" in oj
+        storage_type = oj_storage.get("type", "ftp" if "server_ftp" in oj else "local")
+        if storage_type == "ftp":
+            org.set_storage(org.ftp(), explicit)
+        elif storage_type == "local":
+            org.set_storage(LocalStorage(oj_storage.get("root", "")), explicit)
+        elif storage_type == "webdav":
+            org.set_storage(
+                WebDAVStorage(
+                    oj_storage["url"],
+                    oj_storage["username"],
+                    oj_storage["password"],
+                    oj_storage.get("timeout", 60),
+                ),
+                explicit,
+            )
+        else:
+            raise Exception(f"{name}: unknown storage type {storage_type}")
         self._organizations[name] = org
         return org
 
@@ -49,6 +49,7 @@ if missing:
 from PyQt5.QtWidgets import QApplication  # noqa: E402
 
 from config import Config  # noqa: E402
+from server.phabricator import ConduitTrace, Phabricator  # noqa: E402
 import utils  # noqa: E402
 from ui.appcontext import AppContext  # noqa: E402
 
@@ -106,6 +107,11 @@ if __name__ == "__main__":
     parser.add_argument(
         "--verbose", help="show logs up to the DEBUG level", action="store_true"
     )
+    parser.add_argument(
+        "--trace",
+        help="trace the Phabricator Conduit calls and log a summary on exit",
+        action="store_true",
+    )
     for helper in config.helpers():
         parser.add_argument(
             "--" + str(helper["option"]),
@@ -115,6 +121,8 @@ if __name__ == "__main__":
     args = parser.parse_args()
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
+    if args.trace:
+        Phabricator.trace = ConduitTrace()
     ctx.helper_mode = False
     for helper in config.helpers():
         if getattr(args, str(helper["option"])):
@@ -123,4 +131,6 @@ if __name__ == "__main__":
             f()
             break
     exit_code = ctx.run()
+    if Phabricator.trace:
+        print(Phabricator.trace.summary(), file=sys.stderr)
     sys.exit(exit_code)
@@ -5,11 +5,18 @@
 :license: GNU AGPL version 3, see LICENSE for more details.
 """
 
+import logging
+import os
+import threading
 from typing import List, Optional
 
 from server.caldav import CalDAV
+from server.jira import Jira
+from server.mailqueue import MailQueue
+from server.phabricator import Phabricator
 from server.smtp import SMTP
 from server.ftp import FTP
+from server.storage import Storage
 
 
 class Organization:
@@ -22,15 +29,29 @@ class Organization:
     _jira_users: Optional[List[str]]
     _jira_timetracker_url: Optional[str]
     _calendar: Optional[CalDAV]
+    _jira: Optional[Jira]
+    _phabricator: Optional[Phabricator]
     _smtp: Optional[SMTP]
+    _mail_queue: Optional[MailQueue]
+    _mail_queue_file: Optional[str]
+    _mail_queue_lock: threading.Lock
     _ftp: Optional[FTP]
+    _storage: Optional[Storage]
+    storage_explicit: bool
 
     def __init__(self, name):
         self.name = name
         self._calendar = None
+        self._jira = None
+        self._phabricator = None
         self._excel_reports = None
         self._smtp = None
+        self._mail_queue = None
+        self._mail_queue_file = None
+        self._mail_queue_lock = threading.Lock()
         self._ftp = None
+        self._storage = None
+        self.storage_explicit = False
 
     def set_calendar(self, calendar: Optional[CalDAV]):
         self._calendar = calendar
@@ -41,6 +62,24 @@ class Organization:
         else:
             return self._calendar
 
+    def set_jira(self, jira: Optional[Jira]):
+        self._jira = jira
+
+    def jira(self) -> Jira:
+        if not self._jira:
+            raise Exception(f"{self.name} Jira is not configured")
+        else:
+            return self._jira
+
+    def set_phabricator(self, phabricator: Optional[Phabricator]):
+        self._phabricator = phabricator
+
+    def phabricator(self) -> Phabricator:
+        if not self._phabricator:
+            raise Exception(f"{self.name} Phabricator is not configured")
+        else:
+            return self._phabricator
+
     def set_smtp(self, smtp: Optional[SMTP]):
         self._smtp = smtp
 
@@ -50,6 +89,31 @@ class Organization:
         else:
             return self._smtp
 
+    def set_mail_queue_file(self, path: Optional[str]):
+        self._mail_queue_file = path
+
+    def mail_queue(self) -> MailQueue:
+        """
+        The outbound mail queue, opened (and created) on first use.
+        """
+        with self._mail_queue_lock:
+            if not self._mail_queue:
+                if not self._mail_queue_file:
+                    raise Exception(f"{self.name} mail queue is not configured")
+                self._mail_queue = MailQueue(self.smtp(), self._mail_queue_file)
+            return self._mail_queue
+
+    def resume_mail_queue(self):
+        """
+        Open the mail queue left by a previous run, if any, so that its
+        pending messages are delivered.
+        """
+        if self._mail_queue_file and os.path.exists(self._mail_queue_file):
+            try:
+                self.mail_queue()
+            except Exception as e:
+                logging.error(f"Unable to open the {self.name} mail queue: {e}")
+
     def set_ftp(self, ftp: Optional[FTP]):
         self._ftp = ftp
 
@@ -58,3 +122,17 @@ class Organization:
             raise Exception(f"{self.name} FTP is not configured")
         else:
             return self._ftp
+
+    def set_storage(self, storage: Optional[Storage], explicit: bool = True):
+        """
+        Set the wiki files storage; explicit is False when it's the default
+        one, picked because server_storage isn't configured.
+        """
+        self._storage = storage
+        self.storage_explicit = explicit
+
+    def storage(self) -> Storage:
+        if not self._storage:
+            raise Exception(f"{self.name} storage is not configured")
+        else:
+            return self._storage
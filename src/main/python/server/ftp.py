@@ -5,33 +5,434 @@
 :license: GNU AGPL version 3, see LICENSE for more details.
 """
 
+from collections import OrderedDict
+from contextlib import contextmanager
 import logging
-import os
-from typing import List, Optional
+import posixpath
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
 
 import ftputil
+import ftputil.error
+import ftputil.session
+import ftputil.stat
 
+from server.storage import insert_after_heading, RemoteStat, Storage
 
-class FTP:
+T = TypeVar("T")
+
+
+class ListingCache:
+    """
+    In-memory cache of remote directory listings, evicting the least
+    recently used directory beyond max_dirs.
+    """
+
+    ttl: float
+    max_dirs: int
+    _entries: "OrderedDict[str, Tuple[float, Dict[str, RemoteStat]]]"
+    _lock: threading.Lock
+
+    def __init__(self, ttl: float, max_dirs: int):
+        self.ttl = ttl
+        self.max_dirs = max_dirs
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, directory: str) -> Optional[Dict[str, RemoteStat]]:
+        with self._lock:
+            entry = self._entries.get(directory)
+            if entry and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(directory)
+                return entry[1]
+            self._entries.pop(directory, None)
+            return None
+
+    def put(self, directory: str, listing: Dict[str, RemoteStat]):
+        if self.ttl > 0 and self.max_dirs > 0:
+            with self._lock:
+                self._entries[directory] = (time.monotonic(), listing)
+                self._entries.move_to_end(directory)
+                while len(self._entries) > self.max_dirs:
+                    self._entries.popitem(last=False)
+
+    def invalidate(self, directory: str):
+        with self._lock:
+            self._entries.pop(directory, None)
+
+
+class FTP(Storage):
     """
-    FTP server.
+    FTP server, accessed through a small pool of sessions.
+
+    Idle sessions are closed after idle_timeout seconds by a timer, the ones
+    idle for more than keepalive_interval seconds are checked with
+    keep_alive() before being reused; an operation that fails because its session was dropped is
+    retried once on a new session.
+
+    ftputil reads the times of the listings as UTC: the time shift of the
+    server is either configured (seconds ahead of UTC) or measured with the
+    first session, writing a helper file in the login directory. When it's
+    unknown, the remote modification times can't be trusted and
+    is_uploaded() is always False.
     """
 
     host: str
     port: int
     user: str
     password: str
-    host: ftputil.FTPHost
+    pool_size: int
+    idle_timeout: float
+    keepalive_interval: float
+    _idle: List[Tuple[ftputil.FTPHost, float]]
+    _lock: threading.Lock
+    _slots: threading.BoundedSemaphore
+    _idle_timer: Optional[threading.Timer]
+    _time_shift: Optional[float]
+    _time_shift_failed: bool
+    listing_cache: ListingCache
 
     def __init__(
         self,
         host: str,
         port: int,
         user: str,
-        password: str
+        password: str,
+        pool_size: int = 2,
+        idle_timeout: float = 120,
+        keepalive_interval: float = 15,
+        listing_cache_ttl: float = 60,
+        listing_cache_size: int = 32,
+        time_shift: Optional[float] = None,
     ):
         self.host = host
         self.port = port
         self.user = user
         self.password = password
-        self.host = ftputil.FTPHost(host, user, password)
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._idle_timer = None
+        self.listing_cache = ListingCache(listing_cache_ttl, listing_cache_size)
+        self._time_shift = time_shift
+        self._time_shift_failed = False
+
+    def _connect(self) -> ftputil.FTPHost:
+        logging.debug(f"Opening a new FTP session to {self.host}:{self.port}")
+        ftp_host = ftputil.FTPHost(
+            self.host,
+            self.user,
+            self.password,
+            session_factory=ftputil.session.session_factory(port=self.port),
+        )
+        try:
+            if self._time_shift is not None:
+                ftp_host.set_time_shift(self._time_shift)
+            elif not self._time_shift_failed:
+                try:
+                    ftp_host.synchronize_times()
+                    self._time_shift = ftp_host.time_shift()
+                    logging.debug(f"FTP server time shift: {self._time_shift} s")
+                except ftputil.error.TimeShiftError as e:
+                    logging.warning(
+                        f"Unable to measure the time shift of {self.host} ({e}),"
+                        " unchanged uploads won't be skipped"
+                    )
+                    self._time_shift_failed = True
+        except Exception:
+            self._close(ftp_host)
+            raise
+        return ftp_host
+
+    def _close(self, ftp_host: ftputil.FTPHost):
+        try:
+            ftp_host.close()
+        except Exception as e:
+            logging.debug(f"Error closing an FTP session: {e}")
+
+    def _acquire(self) -> ftputil.FTPHost:
+        """
+        Take the most recently used live session, or open a new one.
+        """
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    expired = self._evict_idle()
+                    idle = self._idle.pop() if self._idle else None
+                for ftp_host, _ in expired:
+                    self._close(ftp_host)
+                if not idle:
+                    break
+                ftp_host, last_used = idle
+                if time.monotonic() - last_used < self.keepalive_interval:
+                    return ftp_host
+                try:
+                    ftp_host.keep_alive()
+                    return ftp_host
+                except Exception as e:
+                    logging.info(f"Discarding a dropped FTP session: {e}")
+                    self._close(ftp_host)
+            return self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, ftp_host: ftputil.FTPHost, healthy: bool):
+        if healthy:
+            with self._lock:
+                self._idle.append((ftp_host, time.monotonic()))
+                self._schedule_eviction()
+        else:
+            self._close(ftp_host)
+        self._slots.release()
+
+    def _evict_idle(self) -> List[Tuple[ftputil.FTPHost, float]]:
+        # Called holding self._lock; the caller closes the expired sessions
+        now = time.monotonic()
+        expired = [s for s in self._idle if now - s[1] >= self.idle_timeout]
+        self._idle = [s for s in self._idle if now - s[1] < self.idle_timeout]
+        return expired
+
+    def _schedule_eviction(self):
+        # Called holding self._lock: close the idle sessions once the oldest
+        # one expires
+        if self._idle_timer:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+        if not self._idle:
+            return
+        oldest = min(last_used for _, last_used in self._idle)
+        delay = max(0.0, oldest + self.idle_timeout - time.monotonic())
+        self._idle_timer = threading.Timer(delay, self._close_idle)
+        self._idle_timer.daemon = True
+        self._idle_timer.start()
+
+    def _close_idle(self):
+        with self._lock:
+            expired = self._evict_idle()
+            self._schedule_eviction()
+        for ftp_host, _ in expired:
+            self._close(ftp_host)
+
+    @staticmethod
+    def _dropped(e: Exception) -> bool:
+        """
+        Whether the error means that the session isn't usable anymore
+        (as opposed to, say, a missing remote file).
+        """
+        if not isinstance(e, (ftputil.error.FTPOSError, ftputil.error.FTPIOError)):
+            return False
+        # 5xx replies are permanent errors of the command, not of the session
+        return not isinstance(e, ftputil.error.PermanentError) and not (
+            e.errno and 500 <= e.errno < 600
+        )
+
+    @contextmanager
+    def session(self) -> Iterator[ftputil.FTPHost]:
+        """
+        Borrow a session from the pool for the duration of the with block.
+        """
+        ftp_host = self._acquire()
+        healthy = True
+        try:
+            yield ftp_host
+        except Exception as e:
+            healthy = not self._dropped(e)
+            raise
+        finally:
+            self._release(ftp_host, healthy)
+
+    def _run(self, operation: Callable[[ftputil.FTPHost], T]) -> T:
+        try:
+            with self.session() as ftp_host:
+                return operation(ftp_host)
+        except Exception as e:
+            if not self._dropped(e):
+                raise
+            logging.warning(f"FTP session dropped ({e}), reconnecting")
+        with self.session() as ftp_host:
+            return operation(ftp_host)
+
+    @staticmethod
+    def _directory(path: str) -> str:
+        return posixpath.normpath(posixpath.dirname(path) or ".")
+
+    def _written(self, *paths: str):
+        for path in paths:
+            self.listing_cache.invalidate(self._directory(path))
+
+    def listdir(self, directory: str) -> Dict[str, RemoteStat]:
+        """
+        Names and stats of the files in a remote directory, from the cache
+        when possible.
+        """
+        directory = posixpath.normpath(directory)
+        listing = self.listing_cache.get(directory)
+        if listing is not None:
+            return listing
+
+        def list_dir(ftp_host: ftputil.FTPHost) -> Dict[str, RemoteStat]:
+            # The stat cache of the session may be stale, since the other
+            # sessions of the pool write too
+            ftp_host.stat_cache.clear()
+            entries = {}
+            # listdir fills the stat cache, so lstat doesn't list again
+            for name in ftp_host.listdir(directory):
+                stat = ftp_host.lstat(posixpath.join(directory, name))
+                precision = stat._st_mtime_precision or ftputil.stat.MINUTE_PRECISION
+                entries[name] = (stat.st_size, stat.st_mtime, precision)
+            return entries
+
+        try:
+            listing = self._run(list_dir)
+        except ftputil.error.PermanentError as e:
+            if e.errno == 550:
+                raise FileNotFoundError(directory) from e
+            raise
+        self.listing_cache.put(directory, listing)
+        return listing
+
+    def is_uploaded(self, source: str, target: str) -> bool:
+        uploaded = super().is_uploaded(source, target)
+        # Known only once a session was opened, by the listing above
+        return uploaded and self._time_shift is not None
+
+    def upload(self, source: str, target: str, skip_unchanged: bool = False) -> bool:
+        if skip_unchanged and self.is_uploaded(source, target):
+            logging.info(f"{target} is up to date, not uploading {source}")
+            return False
+        try:
+            self._run(lambda ftp_host: ftp_host.upload(source, target))
+        finally:
+            self._written(target)
+        return True
+
+    @contextmanager
+    def open(self, path: str, mode: str = "r", **kwargs):
+        """
+        Open a remote file, keeping its session busy until it's closed.
+        Only opening the file is retried on a new session.
+        """
+        try:
+            ftp_host, f = self._open(path, mode, **kwargs)
+            healthy = True
+            try:
+                with f:
+                    yield f
+            except Exception as e:
+                healthy = not self._dropped(e)
+                raise
+            finally:
+                self._release(ftp_host, healthy)
+        finally:
+            if "r" not in mode or "+" in mode:
+                self._written(path)
+
+    def _open(self, path: str, mode: str, **kwargs):
+        """
+        Borrow a session and open a file on it, on a new session when the
+        first one was dropped. The caller releases the session.
+        """
+        ftp_host = self._acquire()
+        try:
+            return ftp_host, ftp_host.open(path, mode, **kwargs)
+        except Exception as e:
+            dropped = self._dropped(e)
+            self._release(ftp_host, not dropped)
+            if not dropped:
+                raise
+            logging.warning(f"FTP session dropped ({e}), reconnecting")
+        ftp_host = self._acquire()
+        try:
+            return ftp_host, ftp_host.open(path, mode, **kwargs)
+        except Exception as e:
+            self._release(ftp_host, not self._dropped(e))
+            raise
+
+    def remove(self, path: str):
+        try:
+            self._run(lambda ftp_host: ftp_host.remove(path))
+        finally:
+            self._written(path)
+
+    def replace(self, source: str, target: str):
+        """
+        Rename source to target, replacing it. Servers that refuse to rename
+        over an existing file get the target removed first, but only while
+        source is still there: when it's gone and target exists, the rename
+        was done by an attempt whose reply was lost.
+        """
+
+        def rename(ftp_host: ftputil.FTPHost):
+            try:
+                ftp_host.rename(source, target)
+            except ftputil.error.PermanentError:
+                # The other sessions of the pool may have changed both files
+                ftp_host.stat_cache.clear()
+                source_exists = ftp_host.path.exists(source)
+                target_exists = ftp_host.path.exists(target)
+                if not source_exists and target_exists:
+                    logging.info(f"{source} was already renamed to {target}")
+                    return
+                if not (source_exists and target_exists):
+                    raise
+                logging.info(f"Replacing {target} non atomically")
+                ftp_host.remove(target)
+                ftp_host.rename(source, target)
+
+        try:
+            self._run(rename)
+        finally:
+            self._written(source, target)
+
+    @contextmanager
+    def open_lines(self, path: str, encoding: str = "utf-8"):
+        with self.open(path, encoding=encoding) as f:
+            yield f
+
+    def write_text(self, path: str, text: str, encoding: str = "utf-8"):
+        with self.open(path, "w", encoding=encoding) as f:
+            f.write(text)
+
+    def stage_line_insert(
+        self, path: str, heading: str, line: str, encoding: str = "utf-8"
+    ) -> str:
+        # Streamed from one session to the other, never held in memory
+        temp_path = self.temp_path(path)
+
+        def copy(ftp_host: ftputil.FTPHost):
+            with ftp_host.open(path, encoding=encoding) as source:
+                with ftp_host.open(temp_path, "w", encoding=encoding) as target:
+                    try:
+                        target.writelines(insert_after_heading(source, heading, line))
+                    except ValueError:
+                        target.close()
+                        ftp_host.remove(temp_path)
+                        raise
+
+        try:
+            self._run(copy)
+        finally:
+            self._written(temp_path)
+        return temp_path
+
+    def makedirs(self, path: str):
+        try:
+            self._run(lambda ftp_host: ftp_host.makedirs(path, exist_ok=True))
+        finally:
+            self._written(path.rstrip("/"))
+
+    def close(self):
+        """
+        Close the idle sessions.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._schedule_eviction()
+        for ftp_host, _ in idle:
+            self._close(ftp_host)
@@ -5,9 +5,16 @@
 :license: GNU AGPL version 3, see LICENSE for more details.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import logging
+import random
+import time
+from typing import Callable, List, Optional, Tuple
 
 import atlassian
+import requests
+from urllib3.exceptions import NewConnectionError
 
 
 class Worklog:
@@ -40,6 +47,28 @@ class Worklog:
         return f"Worklog({self.ticket}, {self.summary} {self.author}, {self.description[:20]}, {self.started} {self.duration})"
 
 
+class BulkResult:
+    """
+    Outcome of a bulk worklog operation.
+    """
+
+    succeeded: List[Worklog]
+    failed: List[Tuple[Worklog, Exception]]
+
+    def __init__(self):
+        self.succeeded = []
+        self.failed = []
+
+    def summary(self) -> str:
+        lines = [f"{len(self.succeeded)} succeeded, {len(self.failed)} failed"]
+        for worklog, error in self.failed:
+            lines.append(f"{worklog.ticket} {worklog.started}: {error}")
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return f"BulkResult({len(self.succeeded)} succeeded, {len(self.failed)} failed)"
+
+
 class Jira:
     """
     Generic Jira server.
@@ -49,6 +78,11 @@ class Jira:
     username: str
     jira: atlassian.Jira
 
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    # Statuses telling that the request wasn't processed, so that it can be
+    # retried even when it isn't idempotent
+    UNPROCESSED_STATUSES = (429, 503)
+
     def __init__(self, url: str, username: str, password: str):
         self.url = url
         self.username = username
@@ -106,3 +140,99 @@ class Jira:
         if not url.startswith("/"):
             url = "/" + url
         return self.jira.delete(url)
+
+    def add_worklogs(
+        self, worklogs: List[Worklog], max_workers: int = 4, max_attempts: int = 4
+    ) -> BulkResult:
+        """
+        Add many worklogs with at most max_workers concurrent requests.
+        Adding a worklog isn't idempotent, so only the requests that weren't
+        processed (rejected with 429 or 503, or whose connection couldn't be
+        opened) are retried.
+        """
+        return self._bulk(
+            self.add_worklog, worklogs, max_workers, max_attempts, idempotent=False
+        )
+
+    def delete_worklogs(
+        self, worklogs: List[Worklog], max_workers: int = 4, max_attempts: int = 4
+    ) -> BulkResult:
+        """
+        Delete many worklogs with at most max_workers concurrent requests,
+        retrying the ones rejected with 429 or 5xx or interrupted by a
+        connection error. A worklog not found on a retry was deleted by an
+        earlier attempt.
+        """
+        return self._bulk(
+            self.delete_worklog, worklogs, max_workers, max_attempts, idempotent=True
+        )
+
+    def _bulk(
+        self,
+        operation: Callable[[Worklog], object],
+        worklogs: List[Worklog],
+        max_workers: int,
+        max_attempts: int,
+        idempotent: bool,
+    ) -> BulkResult:
+        result = BulkResult()
+
+        def run(worklog: Worklog) -> Optional[Exception]:
+            try:
+                self._with_retry(operation, worklog, max_attempts, idempotent)
+                return None
+            except Exception as e:
+                logging.error(f"Jira bulk operation failed for {worklog}: {e}")
+                return e
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            for worklog, error in zip(worklogs, executor.map(run, worklogs)):
+                if error is None:
+                    result.succeeded.append(worklog)
+                else:
+                    result.failed.append((worklog, error))
+        return result
+
+    def _with_retry(
+        self,
+        operation: Callable[[Worklog], object],
+        worklog: Worklog,
+        max_attempts: int,
+        idempotent: bool,
+    ):
+        statuses = self.RETRY_STATUSES if idempotent else self.UNPROCESSED_STATUSES
+        for attempt in range(max_attempts):
+            try:
+                return operation(worklog)
+            except requests.HTTPError as e:
+                response = e.response
+                status = response.status_code if response is not None else None
+                if attempt and idempotent and status == 404:
+                    # Done by a previous attempt, whose response was lost
+                    return None
+                if response is None or status not in statuses or attempt == max_attempts - 1:
+                    raise
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    delay = float(retry_after)
+                else:
+                    delay = 2 ** attempt + random.uniform(0, 1)
+            except requests.ConnectionError as e:
+                if attempt == max_attempts - 1:
+                    raise
+                if not idempotent and not self._connect_failed(e):
+                    # The request may have been sent and processed already
+                    raise
+                delay = 2 ** attempt + random.uniform(0, 1)
+            logging.debug(f"Retrying {worklog} in {delay:.1f} seconds")
+            time.sleep(delay)
+
+    @staticmethod
+    def _connect_failed(e: requests.ConnectionError) -> bool:
+        """
+        Whether the connection couldn't be opened, so nothing was sent.
+        """
+        if isinstance(e, requests.ConnectTimeout):
+            return True
+        reason = getattr(e.args[0], "reason", None) if e.args else None
+        return isinstance(reason, NewConnectionError)
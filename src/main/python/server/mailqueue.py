@@ -0,0 +1,277 @@
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2020 Paolo Bernardi.
+:license: GNU AGPL version 3, see LICENSE for more details.
+"""
+
+from contextlib import closing
+import json
+import logging
+import os
+import random
+import shutil
+import smtplib
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+import uuid
+
+from server.smtp import SMTP
+
+
+class MailQueue:
+    """
+    Outbound mail queue, stored in a SQLite database, delivered through an
+    SMTP server by a background thread.
+
+    The attachments are copied in a spool directory next to the database,
+    so that they can't change or disappear before the message is sent.
+    Failed deliveries are retried with an exponential backoff, unless the
+    server refused the message permanently.
+    """
+
+    QUEUED = "queued"
+    SENDING = "sending"
+    SENT = "sent"
+    FAILED = "failed"
+
+    MAX_ATTEMPTS = 8
+    BACKOFF = 30.0
+    MAX_BACKOFF = 3600.0
+
+    smtp: SMTP
+    path: str
+    spool_dir: str
+    _lock: threading.Lock
+    _wake: threading.Event
+    _stop: threading.Event
+    _worker: Optional[threading.Thread]
+
+    def __init__(self, smtp: SMTP, path: str):
+        self.smtp = smtp
+        self.path = path
+        self.spool_dir = path + ".d"
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._worker = None
+        with closing(self._db()) as db, db:
+            db.execute(
+                """CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created REAL NOT NULL,
+                    message TEXT NOT NULL,
+                    spool TEXT,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt REAL NOT NULL,
+                    last_error TEXT,
+                    sent REAL
+                )"""
+            )
+            # Interrupted while sending by a previous run: try again (the
+            # message may be delivered twice)
+            db.execute(
+                "UPDATE messages SET status = ? WHERE status = ?",
+                (self.QUEUED, self.SENDING),
+            )
+            pending = db.execute(
+                "SELECT COUNT(*) FROM messages WHERE status = ?", (self.QUEUED,)
+            ).fetchone()[0]
+        if pending:
+            self.start()
+
+    def _db(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def _execute(self, sql: str, params=()) -> List[sqlite3.Row]:
+        with self._lock, closing(self._db()) as db, db:
+            return db.execute(sql, params).fetchall()
+
+    def start(self):
+        """
+        Start the delivery thread, if not running yet.
+        """
+        with self._lock:
+            if self._worker and self._worker.is_alive():
+                return
+            self._stop.clear()
+            self._worker = threading.Thread(
+                target=self._run, name="MailQueue", daemon=True
+            )
+            self._worker.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def enqueue(self, **message) -> int:
+        """
+        Queue a message, described by the keyword arguments of
+        SMTP.send_mime_multipart, and return its ID.
+        """
+        attachments = message.get("attachments", [])
+        spool = None
+        if attachments:
+            spool = os.path.join(self.spool_dir, uuid.uuid4().hex)
+            os.makedirs(spool)
+            spooled = []
+            try:
+                for i, attachment in enumerate(attachments):
+                    # Numbered directories keep same-named attachments apart
+                    target = os.path.join(
+                        spool, str(i), os.path.basename(attachment)
+                    )
+                    os.makedirs(os.path.dirname(target))
+                    shutil.copyfile(attachment, target)
+                    spooled.append(target)
+            except Exception:
+                shutil.rmtree(spool, ignore_errors=True)
+                raise
+            message = dict(message, attachments=spooled)
+        now = time.time()
+        with self._lock, closing(self._db()) as db, db:
+            message_id = db.execute(
+                """INSERT INTO messages (created, message, spool, status, next_attempt)
+                VALUES (?, ?, ?, ?, ?)""",
+                (now, json.dumps(message), spool, self.QUEUED, now),
+            ).lastrowid
+        # Always set after an INSERT
+        assert message_id is not None
+        logging.debug(f"Email {message_id} queued: {message.get('subject')}")
+        self.start()
+        self._wake.set()
+        return message_id
+
+    def status(self) -> List[Dict]:
+        """
+        The queued, failed and sent messages, the most recent first.
+        """
+        rows = self._execute(
+            """SELECT id, created, message, status, attempts, next_attempt,
+            last_error, sent FROM messages ORDER BY id DESC"""
+        )
+        entries = []
+        for row in rows:
+            entry = dict(row)
+            message = json.loads(entry.pop("message"))
+            entry["to"] = message["to"]
+            entry["subject"] = message["subject"]
+            entries.append(entry)
+        return entries
+
+    def retry(self, message_id: int):
+        """
+        Deliver again a failed message, as soon as possible.
+        """
+        self._execute(
+            """UPDATE messages SET status = ?, attempts = 0, next_attempt = ?
+            WHERE id = ? AND status = ?""",
+            (self.QUEUED, time.time(), message_id, self.FAILED),
+        )
+        self.start()
+        self._wake.set()
+
+    def remove(self, message_id: int):
+        """
+        Remove a message which isn't being sent, with its spooled attachments.
+        """
+        rows = self._execute(
+            "SELECT spool FROM messages WHERE id = ? AND status != ?",
+            (message_id, self.SENDING),
+        )
+        if rows:
+            self._execute("DELETE FROM messages WHERE id = ?", (message_id,))
+            if rows[0]["spool"]:
+                shutil.rmtree(rows[0]["spool"], ignore_errors=True)
+
+    def clear_sent(self):
+        self._execute("DELETE FROM messages WHERE status = ?", (self.SENT,))
+
+    def _next(self) -> Optional[sqlite3.Row]:
+        """
+        Take the next message due for delivery, marking it as being sent.
+        """
+        with self._lock, closing(self._db()) as db, db:
+            row = db.execute(
+                """SELECT * FROM messages WHERE status = ? AND next_attempt <= ?
+                ORDER BY next_attempt, id LIMIT 1""",
+                (self.QUEUED, time.time()),
+            ).fetchone()
+            if row:
+                db.execute(
+                    "UPDATE messages SET status = ? WHERE id = ?",
+                    (self.SENDING, row["id"]),
+                )
+            return row
+
+    def _seconds_to_next(self) -> Optional[float]:
+        rows = self._execute(
+            "SELECT MIN(next_attempt) AS next FROM messages WHERE status = ?",
+            (self.QUEUED,),
+        )
+        if rows[0]["next"] is None:
+            return None
+        return max(0.0, rows[0]["next"] - time.time())
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                row = self._next()
+                if row:
+                    self._deliver(row)
+                    continue
+                self._wake.wait(self._seconds_to_next())
+                self._wake.clear()
+            except Exception as e:
+                logging.error(f"Mail queue error: {e}")
+                self._stop.wait(self.BACKOFF)
+
+    @staticmethod
+    def _permanent(e: Exception) -> bool:
+        """
+        Whether retrying can't help: the server refused the message with a
+        5xx reply, or an attachment can't be read.
+        """
+        if isinstance(e, smtplib.SMTPRecipientsRefused):
+            return all(code >= 500 for code, _ in e.recipients.values())
+        if isinstance(e, smtplib.SMTPResponseException):
+            return e.smtp_code >= 500
+        return isinstance(e, (FileNotFoundError, PermissionError))
+
+    def _deliver(self, row: sqlite3.Row):
+        message = json.loads(row["message"])
+        try:
+            self.smtp.send(**message)
+        except Exception as e:
+            attempts = row["attempts"] + 1
+            if self._permanent(e) or attempts >= self.MAX_ATTEMPTS:
+                status = self.FAILED
+                next_attempt = time.time()
+                logging.error(f"Email {row['id']} not delivered: {e}")
+            else:
+                status = self.QUEUED
+                delay = min(self.BACKOFF * 2 ** (attempts - 1), self.MAX_BACKOFF)
+                next_attempt = time.time() + delay * random.uniform(0.5, 1)
+                logging.warning(
+                    f"Email {row['id']} not delivered ({e}), "
+                    f"retrying in {delay:.0f} seconds"
+                )
+            self._execute(
+                """UPDATE messages SET status = ?, attempts = ?, next_attempt = ?,
+                last_error = ? WHERE id = ?""",
+                (status, attempts, next_attempt, str(e), row["id"]),
+            )
+            return
+        self._execute(
+            """UPDATE messages SET status = ?, attempts = attempts + 1, sent = ?,
+            last_error = NULL WHERE id = ?""",
+            (self.SENT, time.time(), row["id"]),
+        )
+        if row["spool"]:
+            shutil.rmtree(row["spool"], ignore_errors=True)
+        logging.debug(f"Email {row['id']} sent: {message.get('subject')}")
@@ -6,19 +6,200 @@
 """
 
 import base64
+from bisect import bisect_left
+from collections import Counter
+from concurrent.futures import as_completed, ThreadPoolExecutor
+import json
 import logging
 import os
+import random
 import re
+import threading
 import time
-from typing import Optional
+from typing import Callable, Dict, Iterator, List, Optional, Protocol
+from urllib.parse import urlencode
+import uuid
 
-import phabricator
-from PyQt5 import QtCore
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from utils import dirjoin, sha256
 
 
+class ConduitError(Exception):
+    """
+    Error reported by a Conduit method (the HTTP call itself succeeded).
+    """
+
+    def __init__(self, method: str, code: str, info: str):
+        super().__init__(f"{method}: {code} {info}")
+        self.method = method
+        self.code = code
+        self.info = info
+
+
+class ConduitTrace:
+    """
+    In-process record of the Conduit calls: count, payload size, status
+    and a latency histogram for each method.
+    """
+
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, float("inf"))
+
+    _methods: Dict[str, Dict]
+    _lock: threading.Lock
+
+    def __init__(self):
+        self._methods = {}
+        self._lock = threading.Lock()
+
+    def record(self, method: str, payload_size: int, duration: float, status: str):
+        with self._lock:
+            stats = self._methods.setdefault(
+                method,
+                {
+                    "calls": 0,
+                    "bytes": 0,
+                    "total": 0.0,
+                    "max": 0.0,
+                    "statuses": Counter(),
+                    "histogram": [0] * len(self.BUCKETS),
+                },
+            )
+            stats["calls"] += 1
+            stats["bytes"] += payload_size
+            stats["total"] += duration
+            stats["max"] = max(stats["max"], duration)
+            stats["statuses"][status] += 1
+            stats["histogram"][bisect_left(self.BUCKETS, duration)] += 1
+        logging.debug(
+            f"Conduit {method}: {payload_size} bytes, {duration * 1000:.0f} ms, {status}"
+        )
+
+    def summary(self) -> str:
+        """
+        Text report of the calls, the most time consuming methods first.
+        """
+        header = "  ".join(
+            ["method".ljust(32), "calls", "    KiB", " avg ms", " max ms"]
+            + [f"<{b}s" if b != float("inf") else "more" for b in self.BUCKETS]
+            + ["statuses"]
+        )
+        lines = [header]
+        with self._lock:
+            methods = sorted(self._methods.items(), key=lambda m: -m[1]["total"])
+            for method, stats in methods:
+                statuses = ", ".join(f"{k}: {v}" for k, v in stats["statuses"].items())
+                lines.append(
+                    "  ".join(
+                        [
+                            method.ljust(32),
+                            f"{stats['calls']:5d}",
+                            f"{stats['bytes'] / 1024:7.1f}",
+                            f"{stats['total'] / stats['calls'] * 1000:7.0f}",
+                            f"{stats['max'] * 1000:7.0f}",
+                        ]
+                        + [
+                            f"{n:>{len(f'<{b}s') if b != float('inf') else 4}d}"
+                            for n, b in zip(stats["histogram"], self.BUCKETS)
+                        ]
+                        + [statuses]
+                    )
+                )
+        return "\n".join(lines)
+
+
+class ProgressSignal(Protocol):
+    """
+    Receiver of the upload progress (e.g. a Qt signal), as (value, maximum).
+    """
+
+    def emit(self, value: int, max_value: int) -> None:
+        ...
+
+
+class UploadError(Exception):
+    """
+    Some chunks of a file couldn't be uploaded, even after retrying.
+    """
+
+
+class _SizedBody:
+    """
+    Streamed request body whose length is known in advance, so that it's
+    sent with a Content-Length header rather than chunked.
+    """
+
+    def __init__(self, chunks: Iterator[bytes], length: int):
+        self.chunks = chunks
+        self.length = length
+
+    def __iter__(self):
+        return self.chunks
+
+    def __len__(self):
+        return self.length
+
+
+class UploadJournal:
+    """
+    Local record of the chunked uploads in progress (path, size, modification
+    time, hash and file PHID), so that an interrupted upload can be resumed
+    after a restart by sending only the missing chunks.
+    """
+
+    path: str
+    _entries: Dict[str, Dict]
+    _lock: threading.Lock
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Ignoring the unreadable upload journal {path}: {e}")
+
+    def resumable(self, fpath: str, stat: os.stat_result) -> Optional[str]:
+        """
+        File PHID of an interrupted upload of fpath, if the file is unchanged.
+        """
+        with self._lock:
+            entry = self._entries.get(os.path.realpath(fpath))
+        if (
+            entry
+            and entry["size"] == stat.st_size
+            and entry["mtime"] == stat.st_mtime
+        ):
+            return entry["phid"]
+        return None
+
+    def add(self, fpath: str, stat: os.stat_result, hash: str, phid: str):
+        with self._lock:
+            self._entries[os.path.realpath(fpath)] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "hash": hash,
+                "phid": phid,
+            }
+            self._save()
+
+    def remove(self, fpath: str):
+        with self._lock:
+            if self._entries.pop(os.path.realpath(fpath), None) is not None:
+                self._save()
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._entries, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
 class Phabricator:
     """
     Generic Phabricator server.
@@ -29,17 +210,102 @@ class Phabricator:
     wiki_url: str
     token: str
     user_phid: str
-    phab: phabricator.Phabricator
+    timeout: float
+    upload_workers: int
+    _page_locks: Dict[str, threading.Lock]
+    _page_locks_lock: threading.Lock
+    session: requests.Session
+    stream_session: requests.Session
 
-    PRIO_NORMAL = 50
+    # Conduit call tracing, shared by all the instances (see main.py --trace)
+    trace: Optional["ConduitTrace"] = None
 
-    def __init__(self, url: str, user_phid: str, token: str):
+    # Priority keyword accepted by the maniphest.edit priority transaction
+    PRIO_NORMAL = "normal"
+    UPLOAD_ATTEMPTS = 5
+    UPLOAD_BACKOFF = 1.0
+    STREAM_BUFFER = 3 * 256 * 1024  # A multiple of 3, for base64
+
+    def __init__(
+        self,
+        url: str,
+        user_phid: str,
+        token: str,
+        timeout: float = 60,
+        retries: int = 3,
+        pool_size: int = 8,
+        upload_workers: int = 4,
+    ):
         self.url = url
         self.api_url = dirjoin(url, "api/")
         self.wiki_url = dirjoin(url, "w/")
         self.token = token
         self.user_phid = user_phid
-        self.phab = phabricator.Phabricator(host=self.api_url, token=token, timeout=60)
+        self.timeout = timeout
+        self.upload_workers = upload_workers
+        self._page_locks = {}
+        self._page_locks_lock = threading.Lock()
+        # A single keep-alive session for all the Conduit traffic; only
+        # connection failures and 502/503 (request not processed) are retried,
+        # since Conduit edits are not idempotent.
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=retries,
+            status_forcelist=(502, 503),
+            allowed_methods=None,
+            backoff_factor=0.5,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Streamed request bodies can't be sent twice: their requests are
+        # retried only when the connection can't be opened
+        stream_retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=0,
+            allowed_methods=None,
+            backoff_factor=0.5,
+            raise_on_status=False,
+        )
+        stream_adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=stream_retry)
+        self.stream_session = requests.Session()
+        self.stream_session.mount("https://", stream_adapter)
+        self.stream_session.mount("http://", stream_adapter)
+
+    def conduit(self, method: str, **params):
+        """
+        Call a Conduit method through the shared session and return its result.
+        """
+        params["__conduit__"] = {"token": self.token}
+        data = {"params": json.dumps(params), "output": "json", "__conduit__": "1"}
+        return self._post(method, data=data)
+
+    def _post(self, method: str, session: Optional[requests.Session] = None, **kwargs):
+        url = dirjoin(self.api_url, method)
+        start = time.perf_counter()
+        status = "exception"
+        try:
+            resp = (session or self.session).post(url, timeout=self.timeout, **kwargs)
+            status = str(resp.status_code)
+            resp.raise_for_status()
+            resp_json = resp.json()
+            if resp_json.get("error_code"):
+                status = resp_json["error_code"]
+                raise ConduitError(
+                    method, resp_json["error_code"], resp_json["error_info"]
+                )
+            return resp_json["result"]
+        finally:
+            if self.trace:
+                data = kwargs.get("data")
+                size = len(data) if isinstance(data, _SizedBody) else len(urlencode(data or {}))
+                self.trace.record(method, size, time.perf_counter() - start, status)
 
     def urlize(self, title: str):
         url = title.strip()
@@ -63,121 +329,340 @@ class Phabricator:
         return url
 
     def search_document_by_path(self, path: str, include_body=False):
-        if not path.endswith("/"):
-            path += "/"
-        s = requests.Session()
-        data = {"api.token": self.token}
-        data["constraints[paths][0]"] = path
+        return self.search_documents_by_paths([path], include_body)[path]
+
+    def search_documents_by_paths(
+        self, paths: List[str], include_body=False
+    ) -> Dict[str, Optional[Dict]]:
+        """
+        Look up several Phriction documents with a single search and return
+        a path -> document map (None for the paths that don't exist).
+        """
+        normalized = {p: self._page_path(p) for p in paths}
+        found: Dict[str, Dict] = {}
+        wanted = sorted(set(normalized.values()))
+        params: Dict = {"constraints": {"paths": wanted}}
         if include_body:
-            data["attachments[content]"] = "true"
-        url = dirjoin(self.api_url, "phriction.document.search")
-        req = requests.Request("POST", url, data=data)
-        prepped = s.prepare_request(req)
-        resp = s.send(prepped)
-        resp.raise_for_status()
-        resp_json = resp.json()
-        try:
-            return resp_json["result"]["data"][0]
-        except Exception as e:
-            logging.error("phabricator.search_document_by_path exception")
-            logging.error(e)
-            logging.error(f"JSON response:\n{resp_json}")
-            return None
+            params["attachments"] = {"content": True}
+        while wanted:
+            result = self.conduit("phriction.document.search", **params)
+            for document in result["data"]:
+                path = self._page_path(document["fields"]["path"])
+                found[path] = document
+            after = result.get("cursor", {}).get("after")
+            if not after:
+                break
+            params["after"] = after
+        documents = {path: found.get(norm) for path, norm in normalized.items()}
+        missing = [path for path, document in documents.items() if document is None]
+        if missing:
+            logging.debug(f"Phriction documents not found: {missing}")
+        return documents
+
+    def _page_path(self, slug: str) -> str:
+        """
+        Normalized path of a page, used to match the paths returned by
+        Phriction (which lowercases slugs) and as the lock key.
+        """
+        return slug.rstrip("/").lower() + "/"
 
     def create_page(self, slug: str, title: str, content: str):
-        return self.phab.phriction.create(slug=slug, title=title, content=content)
+        return self.conduit("phriction.create", slug=slug, title=title, content=content)
 
     def update_page(self, slug: str, title: str, content: str):
-        return self.phab.phriction.edit(slug=slug, title=title, content=content)
+        return self.conduit("phriction.edit", slug=slug, title=title, content=content)
+
+    def edit_page(
+        self,
+        slug: str,
+        transform: Callable[[str], str],
+        title: Optional[str] = None,
+        attempts: int = 5,
+    ):
+        """
+        Edit a page by applying transform to its current body.
+
+        Edits of the same page made through this object are serialised by a
+        per-page lock, and the body is always read from the server. Phriction
+        has no conditional edit, so edits made by anyone else are detected
+        afterwards from the version returned by phriction.edit: if some
+        slipped in between the read and the write, they have just been
+        overwritten, so transform is replayed on the latest of them and
+        written again. If the server doesn't report the versions, the check
+        is skipped with a warning.
+        """
+        path = self._page_path(slug)
+        with self._page_lock(path):
+            page = self.search_document_by_path(path, include_body=True)
+            if not page:
+                raise Exception(f"Wiki page not found {path}")
+            content = page["attachments"]["content"]
+            page_title = content["title"]
+            body = content["content"]["raw"]
+            version = content.get("version")
+            if version is None:
+                # Unlike the content attachment, phriction.info always has it
+                version = self.conduit("phriction.info", slug=path).get("version")
+            for attempt in range(attempts):
+                res = self.update_page(slug, title or page_title, transform(body))
+                written = res.get("version")
+                if version is None or written is None:
+                    logging.warning(
+                        f"Unknown version of {path}, concurrent edits can't be detected"
+                    )
+                    return res
+                if int(written) == int(version) + 1:
+                    return res
+                version = int(written)
+                logging.warning(
+                    f"Concurrent edit of {path}, replaying the change on version {version - 1}"
+                )
+                latest = self.get_page_content(page["phid"], version - 1)
+                page_title = latest["title"]
+                body = latest["content"]["raw"]
+        raise Exception(
+            f"Unable to edit {path}: too many concurrent edits. The last write"
+            f" (version {version}) overwrote someone else's edits, they can be"
+            " recovered from the page history"
+        )
+
+    def _page_lock(self, path: str) -> threading.Lock:
+        with self._page_locks_lock:
+            return self._page_locks.setdefault(path, threading.Lock())
+
+    def get_page_content(self, document_phid: str, version: int) -> Dict:
+        """
+        Title and body of a specific version of a Phriction document.
+        """
+        res = self.conduit(
+            "phriction.content.search",
+            constraints={"documentPHIDs": [document_phid], "versions": [version]},
+        )
+        if not res["data"]:
+            raise Exception(f"Version {version} of {document_phid} not found")
+        return res["data"][0]["fields"]
 
     def create_ticket(self, fields):
-        title = fields["summary"]
-        description = fields["description"]
-        owner_phid = fields["assignee"]
-        project_phid = fields["project"]
-        res = self.phab.maniphest.createtask(
-            title=title,
-            description=description,
-            ownerPHID=owner_phid,
-            projectPHIDs=[project_phid],
-            priority=self.PRIO_NORMAL,
+        """
+        Create a Maniphest task with a single maniphest.edit call, setting
+        title, description, owner, project, priority, status and the custom
+        fields at once. The optional "extra_fields" item is a sequence of
+        (transaction type, value) tuples, like update_ticket_fields' ones.
+        Return the ID (as a string) and the PHID of the new task.
+        """
+        res = self.conduit(
+            "maniphest.edit", transactions=self._ticket_transactions(fields)
         )
-        task_phid = res["phid"]
-        transactions = [{"type": "status", "value": "open"}]
-        if "issuetype_field_name" in fields and "issuetype_field_value" in fields:
-            transactions.append(
-                {
-                    "type": fields["issuetype_field_name"],
-                    "value": fields["issuetype_field_value"],
-                }
-            )
-        if "language_field_name" in fields and "language_field_value" in fields:
-            transactions.append(
-                {
-                    "type": fields["language_field_name"],
-                    "value": fields["language_field_value"],
-                }
-            )
-        if "credits_field_name" in fields and "credits_field_value" in fields:
-            transactions.append(
-                {
-                    "type": fields["credits_field_name"],
-                    "value": str(fields["credits_field_value"]),
-                }
-            )
-        self.phab.maniphest.edit(objectIdentifier=task_phid, transactions=transactions)
-        return res
+        task = res["object"]
+        return {"id": str(task["id"]), "phid": task["phid"]}
+
+    def create_tickets(self, fields_list: List[Dict], max_workers: int = 4) -> List:
+        """
+        Create many Maniphest tasks (see create_ticket) with at most
+        max_workers concurrent requests. The result list has the same order
+        of fields_list; the tasks that couldn't be created are replaced by
+        their exception.
+        """
+
+        def create(fields):
+            try:
+                return self.create_ticket(fields)
+            except Exception as e:
+                logging.error(f"Unable to create the task {fields.get('summary')}: {e}")
+                return e
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            return list(executor.map(create, fields_list))
+
+    def _ticket_transactions(self, fields) -> List[Dict]:
+        transactions = [
+            {"type": "title", "value": fields["summary"]},
+            {"type": "description", "value": fields["description"]},
+            {"type": "owner", "value": fields["assignee"]},
+            {"type": "projects.add", "value": [fields["project"]]},
+            {"type": "priority", "value": self.PRIO_NORMAL},
+            {"type": "status", "value": "open"},
+        ]
+        for name in ("issuetype", "language", "credits"):
+            if f"{name}_field_name" in fields and f"{name}_field_value" in fields:
+                value = fields[f"{name}_field_value"]
+                transactions.append(
+                    {
+                        "type": fields[f"{name}_field_name"],
+                        "value": str(value) if name == "credits" else value,
+                    }
+                )
+        transactions.extend(
+            {"type": t[0], "value": t[1]} for t in fields.get("extra_fields", ())
+        )
+        return transactions
 
     def update_ticket_fields(self, task_phid: str, transaction_tuples):
         transactions = [{"type": t[0], "value": t[1]} for t in transaction_tuples]
-        return self.phab.maniphest.edit(
-            objectIdentifier=task_phid, transactions=transactions
+        return self.conduit(
+            "maniphest.edit",
+            objectIdentifier=task_phid,
+            transactions=transactions,
         )
 
-    def upload_file(self, fpath: str, name: str, progress_signal: Optional[QtCore.pyqtSignal] = None):
+    def upload_file(
+        self,
+        fpath: str,
+        name: str,
+        progress_signal: Optional["ProgressSignal"] = None,
+        workers: Optional[int] = None,
+        journal: Optional["UploadJournal"] = None,
+    ):
         if progress_signal:
             progress_signal.emit(0, 100)
-        length = os.path.getsize(fpath)
+        stat = os.stat(fpath)
+        if journal:
+            phid = journal.resumable(fpath, stat)
+            if phid:
+                try:
+                    self._upload_chunks(fpath, phid, progress_signal, workers)
+                    journal.remove(fpath)
+                    return phid
+                except ConduitError as e:
+                    logging.warning(f"Unable to resume {fpath} ({e}), starting over")
+                    journal.remove(fpath)
+        length = stat.st_size
         hash = sha256(fpath)
-        res = self.phab.file.allocate(name=name, contentLength=length, contentHash=hash)
+        res = self.conduit(
+            "file.allocate", name=name, contentLength=length, contentHash=hash
+        )
         phid = res["filePHID"]
-        if phid is None and "error" not in res:
-            with open(fpath, "rb") as f:
-                b64 = base64.b64encode(f.read()).decode("utf-8")
-                res = self.phab.file.upload(data_base64=b64, name=name)
-                if progress_signal:
-                    progress_signal.emit(100, 100)
-                return "".join(res.keys())
+        if phid is not None and not res.get("upload", True):
+            # The server already stores a file with the same content
+            if progress_signal:
+                progress_signal.emit(100, 100)
+            return phid
+        elif phid is None and "error" not in res:
+            return self._upload_whole_file(fpath, name, length, progress_signal)
         elif phid is not None:
-            with open(fpath, "rb") as f:
-                neededChunks = self.phab.file.querychunks(filePHID=phid)
-                for i, neededChunk in enumerate(neededChunks):
-                    if not neededChunk["complete"]:
-                        bstart = int(neededChunk["byteStart"])
-                        bend = int(neededChunk["byteEnd"])
-                        f.seek(bstart)
-                        chunk = f.read(bend - bstart)
-                        b64 = base64.b64encode(chunk).decode("utf-8")
-                        for attempt in range(3):
-                            try:
-                                res = self.phab.file.uploadchunk(
-                                    filePHID=phid,
-                                    byteStart=bstart,
-                                    data=b64,
-                                    dataEncoding="base64",
-                                )
-                                break
-                            except:  # noqa
-                                time.sleep(5)
-                    if progress_signal:
-                        progress_signal.emit(i + 1, len(neededChunks))
-                return phid
+            if journal:
+                journal.add(fpath, stat, hash, phid)
+            self._upload_chunks(fpath, phid, progress_signal, workers)
+            if journal:
+                journal.remove(fpath)
+            return phid
         else:
             logging.error(f"Error: {res['error']}")
             return None
 
+    def _upload_whole_file(
+        self,
+        fpath: str,
+        name: str,
+        length: int,
+        progress_signal: Optional["ProgressSignal"],
+    ):
+        """
+        Upload a file with a single file.upload call. The multipart request
+        body is generated while it's being sent, so only one buffer of the
+        file is in memory at a time.
+        """
+        boundary = uuid.uuid4().hex
+        params = json.dumps({"name": name, "__conduit__": {"token": self.token}})
+        head = (
+            f"--{boundary}\r\n"
+            'Content-Disposition: form-data; name="output"\r\n\r\njson\r\n'
+            f"--{boundary}\r\n"
+            'Content-Disposition: form-data; name="__conduit__"\r\n\r\n1\r\n'
+            f"--{boundary}\r\n"
+            'Content-Disposition: form-data; name="params"\r\n\r\n'
+            '{"data_base64": "'
+        ).encode("utf-8")
+        tail = f'", {params[1:]}\r\n--{boundary}--\r\n'.encode("utf-8")
+        b64_length = (length + 2) // 3 * 4
+
+        def body():
+            yield head
+            sent = 0
+            with open(fpath, "rb") as f:
+                while buffer := f.read(self.STREAM_BUFFER):
+                    yield base64.b64encode(buffer)
+                    sent += len(buffer)
+                    if progress_signal:
+                        progress_signal.emit(sent * 100 // length, 100)
+            yield tail
+
+        return self._post(
+            "file.upload",
+            session=self.stream_session,
+            data=_SizedBody(body(), len(head) + b64_length + len(tail)),
+            headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+        )
+
+    def _upload_chunks(
+        self,
+        fpath: str,
+        phid: str,
+        progress_signal: Optional["ProgressSignal"],
+        workers: Optional[int],
+    ):
+        """
+        Upload the missing chunks of an allocated file with a pool of workers,
+        each one reading and encoding its own chunk.
+        """
+        chunks = self.conduit("file.querychunks", filePHID=phid)
+        missing = [c for c in chunks if not c["complete"]]
+        done = len(chunks) - len(missing)
+        if progress_signal:
+            progress_signal.emit(done, len(chunks))
+        failures = []
+        with ThreadPoolExecutor(max_workers=workers or self.upload_workers) as executor:
+            futures = {
+                executor.submit(
+                    self._upload_chunk,
+                    fpath,
+                    phid,
+                    int(chunk["byteStart"]),
+                    int(chunk["byteEnd"]),
+                ): chunk
+                for chunk in missing
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    chunk = futures[future]
+                    failures.append(f"{chunk['byteStart']}-{chunk['byteEnd']}: {e}")
+                    continue
+                done += 1
+                if progress_signal:
+                    progress_signal.emit(done, len(chunks))
+        if failures:
+            raise UploadError(
+                f"{len(failures)} of {len(chunks)} chunks of {fpath} failed:\n"
+                + "\n".join(failures)
+            )
+
+    def _upload_chunk(self, fpath: str, phid: str, bstart: int, bend: int):
+        with open(fpath, "rb") as f:
+            f.seek(bstart)
+            b64 = base64.b64encode(f.read(bend - bstart)).decode("utf-8")
+        for attempt in range(self.UPLOAD_ATTEMPTS):
+            try:
+                return self.conduit(
+                    "file.uploadchunk",
+                    filePHID=phid,
+                    byteStart=bstart,
+                    data=b64,
+                    dataEncoding="base64",
+                )
+            except Exception as e:
+                if attempt == self.UPLOAD_ATTEMPTS - 1:
+                    raise
+                # Exponential backoff with full jitter
+                delay = random.uniform(0, self.UPLOAD_BACKOFF * 2 ** attempt)
+                logging.warning(
+                    f"Chunk {bstart}-{bend} of {fpath} failed ({e}), retrying in {delay:.1f}s"
+                )
+                time.sleep(delay)
+
     def get_file_by_phid(self, file_phid: str):
-        res = self.phab.file.search(constraints={"phids": [file_phid]})
+        res = self.conduit("file.search", constraints={"phids": [file_phid]})
         if res["data"]:
             return res["data"][0]
         else:
@@ -5,21 +5,45 @@
 :license: GNU AGPL version 3, see LICENSE for more details.
 """
 
-from email import encoders
+import base64
+from email import policy
 from email.mime.base import MIMEBase
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.image import MIMEImage
 import logging
 import os
+import re
 import smtplib
+import socket
+import threading
+import time
 import traceback
-from typing import List, Optional
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import uuid
+
+HTML_HEAD = """<html>
+  <head>
+    <meta http-equiv="content-type" content="text/html; charset=iso-8859-15">
+  </head>
+  <body bgcolor="#FFFFFF" text="#000000">
+    """
+
+HTML_SIGNATURE = """
+    <br>
+    <div class="moz-signature">-- <br>
+      {signature}
+    </div>
+  </body>
+</html>"""
 
 
 class SMTP:
     """
     SMTP server with a TLS connection over port 587.
+
+    The authenticated session is reused by the following messages and
+    closed once it's been idle for idle_timeout seconds.
     """
 
     host: str
@@ -28,6 +52,18 @@ class SMTP:
     password: str
     default_from_address: str
     html_signature: str
+    idle_timeout: float
+    timeout: float
+    _connection: Optional[smtplib.SMTP]
+    _last_used: float
+    _idle_timer: Optional[threading.Timer]
+    _lock: threading.RLock
+    _images: Dict[str, Tuple[int, MIMEImage]]
+    _signature: Optional[Tuple[str, str]]
+
+    # Bytes of the attachments read at a time: 57 bytes are a 76 characters
+    # base64 line
+    CHUNK_SIZE = 57 * 1024
 
     def __init__(
         self,
@@ -37,6 +73,8 @@ class SMTP:
         password: str,
         default_from_address: str,
         html_signature: str,
+        idle_timeout: float = 60,
+        timeout: float = 60,
     ):
         self.host = host
         self.port = port
@@ -44,8 +82,217 @@ class SMTP:
         self.password = password
         self.default_from_address = default_from_address
         self.html_signature = html_signature
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._connection = None
+        self._last_used = 0.0
+        self._idle_timer = None
+        self._lock = threading.RLock()
+        self._images = {}
+        self._signature = None
 
-    def send_mime_multipart(
+    def _connect(self) -> smtplib.SMTP:
+        logging.debug(f"Opening a new SMTP session to {self.host}:{self.port}")
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            # DATA is sent with many writes before reading the reply: without
+            # TCP_NODELAY, every message waits for a delayed ACK
+            assert connection.sock is not None  # Connected by the constructor
+            connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection.ehlo()
+            connection.starttls()
+            connection.ehlo()
+            connection.login(self.user, self.password)
+        except Exception:
+            connection.close()
+            raise
+        return connection
+
+    def _close_if_idle(self):
+        with self._lock:
+            if time.monotonic() - self._last_used >= self.idle_timeout:
+                self._close()
+
+    def _close(self):
+        # Called holding self._lock
+        if self._connection:
+            try:
+                self._connection.quit()
+            except Exception as e:
+                logging.debug(f"Error closing the SMTP session: {e}")
+                self._connection.close()
+            self._connection = None
+
+    def close(self):
+        """
+        Close the SMTP session, if open.
+        """
+        with self._lock:
+            if self._idle_timer:
+                self._idle_timer.cancel()
+                self._idle_timer = None
+            self._close()
+
+    def _sendmail(
+        self,
+        from_address: str,
+        recipients: List[str],
+        message: Callable[[], Iterator[bytes]],
+    ):
+        """
+        Send a message, streamed by the message() generator, on the SMTP
+        session. The session is opened when needed, or when the server
+        dropped it before DATA: once DATA started the message is never sent
+        twice. Its closing is scheduled after idle_timeout.
+        """
+        with self._lock:
+            for attempt in range(2):
+                connection = self._connection or self._connect()
+                self._connection = connection
+                try:
+                    refused = self._send_envelope(connection, from_address, recipients)
+                    break
+                except smtplib.SMTPServerDisconnected as e:
+                    # Nothing was sent yet, the message can be sent again
+                    self._connection = None
+                    if attempt:
+                        raise
+                    logging.info(f"SMTP session dropped ({e}), reconnecting")
+                except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+                    raise
+                except Exception:
+                    self._drop()
+                    raise
+            try:
+                self._send_data(connection, message(), refused)
+            except smtplib.SMTPResponseException:
+                raise
+            except Exception:
+                # Interrupted in the middle of DATA, the session is unusable.
+                # The server may have received the message anyway, so it is
+                # not sent again
+                self._drop()
+                raise
+            self._last_used = time.monotonic()
+            if self._idle_timer:
+                self._idle_timer.cancel()
+            self._idle_timer = threading.Timer(self.idle_timeout, self._close_if_idle)
+            self._idle_timer.daemon = True
+            self._idle_timer.start()
+
+    def _drop(self):
+        # Called holding self._lock
+        if self._connection:
+            self._connection.close()
+            self._connection = None
+
+    @staticmethod
+    def _send_envelope(
+        connection: smtplib.SMTP, from_address: str, recipients: List[str]
+    ) -> Dict[str, Tuple[int, bytes]]:
+        """
+        Send the sender and the recipients of a message, like the first half
+        of smtplib.SMTP.sendmail. Return the refused recipients.
+        """
+        connection.ehlo_or_helo_if_needed()
+        code, resp = connection.mail(from_address)
+        if code != 250:
+            connection.rset()
+            raise smtplib.SMTPSenderRefused(code, resp, from_address)
+        refused = {}
+        for recipient in recipients:
+            code, resp = connection.rcpt(recipient)
+            if code not in (250, 251):
+                refused[recipient] = (code, resp)
+        if len(refused) == len(recipients):
+            connection.rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        return refused
+
+    @staticmethod
+    def _send_data(
+        connection: smtplib.SMTP,
+        chunks: Iterator[bytes],
+        refused: Dict[str, Tuple[int, bytes]],
+    ):
+        """
+        Like the second half of smtplib.SMTP.sendmail, but the message is sent
+        a chunk at a time during DATA. The chunks must be dot-stuffed and end
+        with CRLF.
+        """
+        connection.putcmd("data")
+        code, resp = connection.getreply()
+        if code != 354:
+            connection.rset()
+            raise smtplib.SMTPDataError(code, resp)
+        for chunk in chunks:
+            connection.send(chunk)
+        connection.send(b".\r\n")
+        code, resp = connection.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, resp)
+        if refused:
+            logging.warning(f"Some recipients were refused: {refused}")
+
+    def _iter_message(
+        self, outer: MIMEMultipart, attachments: Dict[str, str]
+    ) -> Iterator[bytes]:
+        """
+        Serialize a message composed by _compose, encoding the attachments
+        (whose payloads are placeholders) a chunk at a time.
+        """
+        skeleton = outer.as_bytes()
+        if not skeleton.endswith(b"\r\n"):
+            skeleton += b"\r\n"
+        pieces = [skeleton]
+        if attachments:
+            # Each placeholder is on a line of its own: split around them
+            pattern = b"|".join(re.escape(p.encode()) for p in attachments)
+            pieces = re.split(b"(" + pattern + b")\r\n", skeleton)
+        for i, piece in enumerate(pieces):
+            if i % 2:
+                yield from self._iter_base64(attachments[piece.decode()])
+            else:
+                yield re.sub(rb"(?m)^\.", b"..", piece)
+
+    def _iter_base64(self, path: str) -> Iterator[bytes]:
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield base64.encodebytes(chunk).replace(b"\n", b"\r\n")
+
+    def _signature_html(self) -> str:
+        """
+        The end of the HTML body, with the signature; rendered again only
+        when html_signature changes.
+        """
+        if not self._signature or self._signature[0] != self.html_signature:
+            self._signature = (
+                self.html_signature,
+                HTML_SIGNATURE.format(signature=self.html_signature),
+            )
+        return self._signature[1]
+
+    def _image(self, image_filename: str) -> MIMEImage:
+        """
+        The (base64 encoded) part of an image, cached until the file is
+        modified. The part is shared by the messages, so it's never changed
+        after being built.
+        """
+        mtime = os.stat(image_filename).st_mtime_ns
+        cached = self._images.get(image_filename)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(image_filename, "rb") as image:
+            msg = MIMEImage(image.read())
+        image_title = os.path.splitext(os.path.basename(image_filename))[0]
+        msg.add_header("Content-ID", f"<{image_title}>")
+        self._images[image_filename] = (mtime, msg)
+        return msg
+
+    def _compose(
         self,
         to: List[str],
         subject: str,
@@ -54,8 +301,14 @@ class SMTP:
         cc: List[str] = [],
         attachments: List[str] = [],
         images: List[str] = [],
-    ):
-        outer = MIMEMultipart("related")
+    ) -> Tuple[MIMEMultipart, Dict[str, str]]:
+        """
+        Build a message with the HTML signature, the attachments and the
+        (signature) images. The attachments aren't read: their payloads are
+        placeholders, returned with the attachment paths and replaced by
+        _iter_message.
+        """
+        outer = MIMEMultipart("related", policy=policy.SMTP)
         outer["Subject"] = subject
         outer["From"] = from_address or self.default_from_address
         outer["To"] = ", ".join(to)
@@ -64,51 +317,86 @@ class SMTP:
         outer.preamble = (
             "If you see this, please open this message with a MIME-aware mail reader.\n"
         )
-        html = f"""<html>
-  <head>
-    <meta http-equiv="content-type" content="text/html; charset=iso-8859-15">
-  </head>
-  <body bgcolor="#FFFFFF" text="#000000">
-    {body_html}
-    <br>
-    <div class="moz-signature">-- <br>
-      {self.html_signature}
-    </div>
-  </body>
-</html>"""
+        html = HTML_HEAD + body_html + self._signature_html()
         outer.attach(MIMEText(html, "html"))
+        placeholders = {}
         for att in attachments:
-            try:
-                with open(att, "rb") as fp:
-                    msg = MIMEBase("application", "octet-stream")
-                    msg.set_payload(fp.read())
-                encoders.encode_base64(msg)
-                msg.add_header(
-                    "Content-Disposition", "attachment", filename=os.path.basename(att)
-                )
-                outer.attach(msg)
-            except Exception:
-                logging.error(
-                    "Unable to open one of the attachments. " + traceback.format_exc()
-                )
-                return
+            # Fail now rather than in the middle of the SMTP DATA command
+            with open(att, "rb"):
+                pass
+            placeholder = f"attachment-{uuid.uuid4().hex}"
+            placeholders[placeholder] = att
+            msg = MIMEBase("application", "octet-stream")
+            msg.set_payload(placeholder)
+            msg["Content-Transfer-Encoding"] = "base64"
+            msg.add_header(
+                "Content-Disposition", "attachment", filename=os.path.basename(att)
+            )
+            outer.attach(msg)
         # Add images, maily used for signatures
         for image_filename in images:
-            with open(image_filename, "rb") as image:
-                msg = MIMEImage(image.read())
-            image_title = os.path.splitext(os.path.basename(image_filename))[0]
-            msg.add_header("Content-ID", f"<{image_title}>")
-            outer.attach(msg)
-        composed = outer.as_string()
+            outer.attach(self._image(image_filename))
+        return outer, placeholders
+
+    def send(
+        self,
+        to: List[str],
+        subject: str,
+        body_html: str,
+        from_address: Optional[str] = None,
+        cc: List[str] = [],
+        attachments: List[str] = [],
+        images: List[str] = [],
+    ):
+        """
+        Like send_mime_multipart, but unreadable attachments raise OSError.
+        """
+        outer, placeholders = self._compose(
+            to, subject, body_html, from_address, cc, attachments, images
+        )
+        self._sendmail(
+            outer["From"], to + cc, lambda: self._iter_message(outer, placeholders)
+        )
+
+    def send_mime_multipart(
+        self,
+        to: List[str],
+        subject: str,
+        body_html: str,
+        from_address: Optional[str] = None,
+        cc: List[str] = [],
+        attachments: List[str] = [],
+        images: List[str] = [],
+    ):
+        try:
+            outer, placeholders = self._compose(
+                to, subject, body_html, from_address, cc, attachments, images
+            )
+        except OSError:
+            logging.error(
+                "Unable to open one of the attachments. " + traceback.format_exc()
+            )
+            return
         # Send the email
-        with smtplib.SMTP(self.host, self.port) as s:
-            s.ehlo()
-            s.starttls()
-            s.ehlo()
-            s.login(self.user, self.password)
-            all_tos = to
-            if cc:
-                all_tos += cc
-            s.sendmail(outer["From"], all_tos, composed)
-            s.close()
+        self._sendmail(
+            outer["From"], to + cc, lambda: self._iter_message(outer, placeholders)
+        )
         logging.debug("Email sent!")
+
+    def send_many(self, messages: List[Dict]) -> List[Optional[Exception]]:
+        """
+        Send many messages, each one described by the keyword arguments of
+        send_mime_multipart, on the same SMTP session. The result list has
+        the same order of messages: None for the ones that were sent, the
+        exception for the others.
+        """
+        results: List[Optional[Exception]] = []
+        for message in messages:
+            try:
+                self.send(**message)
+                results.append(None)
+            except Exception as e:
+                logging.error(f"Unable to send {message.get('subject')}: {e}")
+                results.append(e)
+        logging.debug(f"{results.count(None)} of {len(messages)} emails sent")
+        return results
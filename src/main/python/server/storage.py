@@ -0,0 +1,313 @@
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2020 Paolo Bernardi.
+:license: GNU AGPL version 3, see LICENSE for more details.
+"""
+
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+import io
+import logging
+import os
+import posixpath
+import shutil
+import tempfile
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+from urllib.parse import quote, unquote, urlparse
+import uuid
+from xml.etree import ElementTree
+
+import requests
+
+# Size, modification time and its precision (in seconds) of a stored file
+RemoteStat = Tuple[int, float, float]
+
+
+def insert_after_heading(lines: Iterable[str], heading: str, line: str) -> Iterator[str]:
+    """
+    Yield the lines, adding line right after the first one equal to heading
+    (surrounding whitespace aside); raise ValueError at the end when there's
+    no such heading.
+    """
+    heading = heading.strip()
+    if not line.endswith("\n"):
+        line += "\n"
+    found = False
+    for current in lines:
+        if not found and current.strip() == heading:
+            found = True
+            yield current if current.endswith("\n") else current + "\n"
+            yield line
+        else:
+            yield current
+    if not found:
+        raise ValueError(f"Heading {heading!r} not found")
+
+
+class Storage(ABC):
+    """
+    Where the wiki files (pages and media) of an organization are stored.
+    Paths use forward slashes, whatever the backend.
+    """
+
+    @abstractmethod
+    def upload(self, source: str, target: str, skip_unchanged: bool = False) -> bool:
+        """
+        Store a local file; with skip_unchanged, a file that was already
+        stored (see is_uploaded) isn't transferred again. Return whether
+        the file was transferred.
+        """
+
+    @abstractmethod
+    def open_lines(self, path: str, encoding: str = "utf-8"):
+        """
+        Context manager iterating on the lines of a text file.
+        """
+
+    @abstractmethod
+    def write_text(self, path: str, text: str, encoding: str = "utf-8"):
+        pass
+
+    @abstractmethod
+    def stage_line_insert(
+        self, path: str, heading: str, line: str, encoding: str = "utf-8"
+    ) -> str:
+        """
+        Copy a text file to a temporary file, inserting line right after
+        heading (see insert_after_heading), and return the temporary file
+        path. Commit the edit with replace().
+        """
+
+    @abstractmethod
+    def replace(self, source: str, target: str):
+        """
+        Rename source to target, replacing it.
+        """
+
+    @abstractmethod
+    def remove(self, path: str):
+        pass
+
+    @abstractmethod
+    def listdir(self, directory: str) -> Dict[str, RemoteStat]:
+        """
+        Names and stats of the entries of a directory.
+        """
+
+    @abstractmethod
+    def makedirs(self, path: str):
+        """
+        Create a directory and its missing parents.
+        """
+
+    @staticmethod
+    def temp_path(path: str) -> str:
+        directory, name = posixpath.split(path)
+        return posixpath.join(directory, f".{name}.{uuid.uuid4().hex}.tmp")
+
+    def stat(self, path: str) -> Optional[RemoteStat]:
+        """
+        Stat of a file or directory, None if it doesn't exist.
+        """
+        path = path.rstrip("/")
+        directory = posixpath.dirname(path) or "."
+        try:
+            listing = self.listdir(directory)
+        except FileNotFoundError:
+            return None
+        return listing.get(posixpath.basename(path))
+
+    def exists(self, path: str) -> bool:
+        return self.stat(path) is not None
+
+    def is_uploaded(self, source: str, target: str) -> bool:
+        """
+        Whether target has the same size of the local source file and it
+        isn't older than it (within the precision of the backend).
+        """
+        stored = self.stat(target)
+        if stored is None:
+            return False
+        local = os.stat(source)
+        size, mtime, precision = stored
+        return size == local.st_size and mtime + precision >= local.st_mtime
+
+    def insert_line(self, path: str, heading: str, line: str, encoding: str = "utf-8"):
+        """
+        Insert line after heading in a text file (see stage_line_insert),
+        replacing the file only once it's complete.
+        """
+        self.replace(self.stage_line_insert(path, heading, line, encoding), path)
+
+
+class LocalStorage(Storage):
+    """
+    Local filesystem (or a network share mounted on it); relative paths
+    are resolved against root.
+    """
+
+    root: str
+
+    def __init__(self, root: str = ""):
+        self.root = root
+
+    def _local(self, path: str) -> str:
+        return os.path.join(self.root, path) if self.root else path
+
+    def upload(self, source: str, target: str, skip_unchanged: bool = False) -> bool:
+        if skip_unchanged and self.is_uploaded(source, target):
+            logging.info(f"{target} is up to date, not copying {source}")
+            return False
+        temp_path = self._local(self.temp_path(target))
+        try:
+            shutil.copyfile(source, temp_path)
+            os.replace(temp_path, self._local(target))
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return True
+
+    @contextmanager
+    def open_lines(self, path: str, encoding: str = "utf-8"):
+        with open(self._local(path), encoding=encoding) as f:
+            yield f
+
+    def write_text(self, path: str, text: str, encoding: str = "utf-8"):
+        with open(self._local(path), "w", encoding=encoding) as f:
+            f.write(text)
+
+    def stage_line_insert(
+        self, path: str, heading: str, line: str, encoding: str = "utf-8"
+    ) -> str:
+        temp_path = self.temp_path(path)
+        try:
+            with open(self._local(path), encoding=encoding) as source:
+                with open(self._local(temp_path), "w", encoding=encoding) as target:
+                    target.writelines(insert_after_heading(source, heading, line))
+        except Exception:
+            if os.path.exists(self._local(temp_path)):
+                os.remove(self._local(temp_path))
+            raise
+        return temp_path
+
+    def replace(self, source: str, target: str):
+        os.replace(self._local(source), self._local(target))
+
+    def remove(self, path: str):
+        os.remove(self._local(path))
+
+    def listdir(self, directory: str) -> Dict[str, RemoteStat]:
+        listing = {}
+        with os.scandir(self._local(directory)) as entries:
+            for entry in entries:
+                stat = entry.stat()
+                listing[entry.name] = (stat.st_size, stat.st_mtime, 0.0)
+        return listing
+
+    def makedirs(self, path: str):
+        os.makedirs(self._local(path), exist_ok=True)
+
+
+class WebDAVStorage(Storage):
+    """
+    WebDAV server (e.g. Nextcloud); paths are relative to url.
+    """
+
+    url: str
+    timeout: float
+    session: requests.Session
+
+    DAV_NS = "{DAV:}"
+
+    def __init__(self, url: str, username: str, password: str, timeout: float = 60):
+        self.url = url if url.endswith("/") else url + "/"
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.auth = (username, password)
+
+    def _url(self, path: str) -> str:
+        return self.url + quote(path.lstrip("/"))
+
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        resp = self.session.request(
+            method, self._url(path), timeout=self.timeout, **kwargs
+        )
+        if resp.status_code == 404:
+            raise FileNotFoundError(path)
+        resp.raise_for_status()
+        return resp
+
+    def upload(self, source: str, target: str, skip_unchanged: bool = False) -> bool:
+        if skip_unchanged and self.is_uploaded(source, target):
+            logging.info(f"{target} is up to date, not uploading {source}")
+            return False
+        with open(source, "rb") as f:
+            self._request("PUT", target, data=f)
+        return True
+
+    @contextmanager
+    def open_lines(self, path: str, encoding: str = "utf-8"):
+        resp = self._request("GET", path, stream=True)
+        try:
+            resp.raw.decode_content = True
+            yield io.TextIOWrapper(resp.raw, encoding=encoding)
+        finally:
+            resp.close()
+
+    def write_text(self, path: str, text: str, encoding: str = "utf-8"):
+        self._request("PUT", path, data=text.encode(encoding))
+
+    def stage_line_insert(
+        self, path: str, heading: str, line: str, encoding: str = "utf-8"
+    ) -> str:
+        # Spooled to a local temporary file, so that the download is over
+        # before the upload starts
+        temp_path = self.temp_path(path)
+        with tempfile.TemporaryFile() as spool:
+            with self.open_lines(path, encoding) as source:
+                for current in insert_after_heading(source, heading, line):
+                    spool.write(current.encode(encoding))
+            spool.seek(0)
+            self._request("PUT", temp_path, data=spool)
+        return temp_path
+
+    def replace(self, source: str, target: str):
+        self._request(
+            "MOVE",
+            source,
+            headers={"Destination": self._url(target), "Overwrite": "T"},
+        )
+
+    def remove(self, path: str):
+        self._request("DELETE", path)
+
+    def listdir(self, directory: str) -> Dict[str, RemoteStat]:
+        directory = directory.rstrip("/") + "/" if directory not in ("", ".") else ""
+        resp = self._request("PROPFIND", directory, headers={"Depth": "1"})
+        base = unquote(urlparse(self._url(directory)).path).rstrip("/")
+        listing = {}
+        for response in ElementTree.fromstring(resp.content).iter(
+            self.DAV_NS + "response"
+        ):
+            href = unquote(urlparse(response.findtext(self.DAV_NS + "href")).path)
+            if href.rstrip("/") == base:
+                continue
+            size = response.findtext(f".//{self.DAV_NS}getcontentlength")
+            modified = response.findtext(f".//{self.DAV_NS}getlastmodified")
+            mtime = parsedate_to_datetime(modified).timestamp() if modified else 0.0
+            listing[posixpath.basename(href.rstrip("/"))] = (int(size or 0), mtime, 1.0)
+        return listing
+
+    def makedirs(self, path: str):
+        current = ""
+        for part in path.strip("/").split("/"):
+            current = posixpath.join(current, part) if current else part
+            resp = self.session.request(
+                "MKCOL", self._url(current + "/"), timeout=self.timeout
+            )
+            # 405: the collection exists already
+            if resp.status_code not in (201, 405):
+                resp.raise_for_status()
@@ -6,8 +6,10 @@
 """
 
 from calendar import different_locale
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import locale
+import logging
 import os
 import shutil
 from typing import cast, Dict, List
@@ -31,6 +33,36 @@ class Bills:
         self.org = org
         self.helper = helper
 
+    def _publish(
+        self,
+        pdf_path: str,
+        wiki_file_name: str,
+        wiki_page_file: str,
+        heading: str,
+        newline: str,
+    ):
+        """
+        Upload the bill PDF and add its row under the heading of the wiki
+        page. The edited page is staged (on another FTP session, with the FTP
+        storage) while the PDF is being uploaded, and it replaces the page
+        only once the upload succeeded.
+        """
+        storage = self.org.storage()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pdf_upload = executor.submit(
+                storage.upload, pdf_path, wiki_file_name, skip_unchanged=True
+            )
+            staged = storage.stage_line_insert(wiki_page_file, heading, newline)
+            try:
+                pdf_upload.result()
+            except Exception:
+                try:
+                    storage.remove(staged)
+                except Exception as e:
+                    logging.warning(f"Unable to remove {staged}: {e}")
+                raise
+        storage.replace(staged, wiki_page_file)
+
     def upload_telephone(
         self,
         t_due_date: datetime,
@@ -45,7 +77,7 @@ class Bills:
             month_str_for_table = t_month.strftime("%B %Y").lower()
             file_name = f"bolletta_{month_str}.pdf"
         #
-        # Upload the attachment
+        # Prepare the attachment
         #
         if len(pdf_files) > 1:
             pdf_file = concatenate_pdfs(pdf_files)
@@ -54,20 +86,20 @@ class Bills:
         new_pdf_path = os.path.join(os.path.dirname(pdf_file), file_name)
         os.rename(pdf_file, new_pdf_path)
         wiki_file_name = dirjoin(params["telephone_dir"], file_name)
-        self.org.ftp().host.upload(new_pdf_path, wiki_file_name)
         #
-        # Update the specific bill wiki page
+        # Upload the attachment and update the specific bill wiki page
         #
         due_date_str = t_due_date.strftime("%d/%m/%Y")
         with change_locale("de_DE"):
             amount_str = locale.format_string("%.2f", t_amount)
-        with self.org.ftp().host.open(params["telephone_file"], encoding="utf-8") as f:
-            lines = f.readlines()
-        index = lines.index(params["telephone_heading"])
         newline = f"|{due_date_str}|{month_str_for_table}|€ {amount_str}| {{{{ {params['telephone_prefix'] + file_name}'?linkonly|Download}}}} | {t_notes} |\n"
-        lines.insert(index + 1, newline)
-        with self.org.ftp().host.open(params["telephone_file"], "w", encoding="utf-8") as f:
-            f.writelines(lines)
+        self._publish(
+            new_pdf_path,
+            wiki_file_name,
+            params["telephone_file"],
+            params["telephone_heading"],
+            newline,
+        )
 
     def upload_electricity(
         self,
@@ -82,7 +114,7 @@ class Bills:
             month_str = e_due_date.strftime("%Y_%m")
             file_name = f"bolletta_{month_str}.pdf"
         #
-        # Upload the attachment
+        # Prepare the attachment
         #
         if len(pdf_files) > 1:
             pdf_file = concatenate_pdfs(pdf_files)
@@ -91,20 +123,20 @@ class Bills:
         new_pdf_path = os.path.join(os.path.dirname(pdf_file), file_name)
         os.rename(pdf_file, new_pdf_path)
         wiki_file_name = dirjoin(params["electricity_dir"], file_name)
-        self.org.ftp().host.upload(new_pdf_path, wiki_file_name)
         #
-        # Update the specific bill wiki page
+        # Upload the attachment and update the specific bill wiki page
         #
         due_date_str = e_due_date.strftime("%d/%m/%Y")
         with change_locale("de_DE"):
             amount_str = locale.format_string("%.2f", e_amount)
-        with self.org.ftp().host.open(params["electricity_file"], encoding="utf-8") as f:
-            lines = f.readlines()
-        index = lines.index(params["electricity_heading"])
         newline = f"|{due_date_str}|{e_interval}|€ {amount_str}| {{{{ {params['electricity_prefix'] + file_name}'?linkonly|Download}}}} | {e_notes} |\n"
-        lines.insert(index + 1, newline)
-        with self.org.ftp().host.open(params["electricity_file"], "w", encoding="utf-8") as f:
-            f.writelines(lines)
+        self._publish(
+            new_pdf_path,
+            wiki_file_name,
+            params["electricity_file"],
+            params["electricity_heading"],
+            newline,
+        )
 
     def upload_gas(
         self,
@@ -120,7 +152,7 @@ class Bills:
             month_str = g_date.strftime("%Y_%m")
             file_name = f"bolletta_gas_{month_str}.pdf"
         #
-        # Upload the attachment
+        # Prepare the attachment
         #
         if len(pdf_files) > 1:
             pdf_file = concatenate_pdfs(pdf_files)
@@ -129,20 +161,20 @@ class Bills:
         new_pdf_path = os.path.join(os.path.dirname(pdf_file), file_name)
         os.rename(pdf_file, new_pdf_path)
         wiki_file_name = dirjoin(params["gas_dir"], file_name)
-        self.org.ftp().host.upload(new_pdf_path, wiki_file_name)
         #
-        # Update the specific bill wiki page
+        # Upload the attachment and update the specific bill wiki page
         #
         date_str = g_date.strftime("%d/%m/%Y")
         with change_locale("de_DE"):
             amount_str = locale.format_string("%.2f", g_amount)
-        with self.org.ftp().host.open(params["gas_file"], encoding="utf-8") as f:
-            lines = f.readlines()
-        index = lines.index(params["gas_heading"])
         newline = f"|{date_str}|{g_interval}|€ {amount_str}|{g_cubic_meters}|{{{{ {params['gas_prefix'] + file_name}'?linkonly|Download}}}} | {g_notes} |\n"
-        lines.insert(index + 1, newline)
-        with self.org.ftp().host.open(params["gas_file"], "w", encoding="utf-8") as f:
-            f.writelines(lines)
+        self._publish(
+            new_pdf_path,
+            wiki_file_name,
+            params["gas_file"],
+            params["gas_heading"],
+            newline,
+        )
 
     def upload_water(
         self,
@@ -158,7 +190,7 @@ class Bills:
             month_str = w_date.strftime("%Y_%m")
             file_name = f"bolletta_acqua_{month_str}.pdf"
         #
-        # Upload the attachment
+        # Prepare the attachment
         #
         if len(pdf_files) > 1:
             pdf_file = concatenate_pdfs(pdf_files)
@@ -167,17 +199,17 @@ class Bills:
         new_pdf_path = os.path.join(os.path.dirname(pdf_file), file_name)
         os.rename(pdf_file, new_pdf_path)
         wiki_file_name = dirjoin(params["water_dir"], file_name)
-        self.org.ftp().host.upload(new_pdf_path, wiki_file_name)
         #
-        # Update the specific bill wiki page
+        # Upload the attachment and update the specific bill wiki page
         #
         date_str = w_date.strftime("%d/%m/%Y")
         with change_locale("de_DE"):
             amount_str = locale.format_string("%.2f", w_amount)
-        with self.org.ftp().host.open(params["water_file"], encoding="utf-8") as f:
-            lines = f.readlines()
-        index = lines.index(params["water_heading"])
         newline = f"|{date_str}|{w_interval}|€ {amount_str}|{{{{ {params['water_prefix'] + file_name}?linkonly|Download}}}}|{w_notes}|\n"
-        lines.insert(index + 1, newline)
-        with self.org.ftp().host.open(params["water_file"], "w", encoding="utf-8") as f:
-            f.writelines(lines)
+        self._publish(
+            new_pdf_path,
+            wiki_file_name,
+            params["water_file"],
+            params["water_heading"],
+            newline,
+        )
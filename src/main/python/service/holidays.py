@@ -10,13 +10,12 @@ from datetime import datetime
 import os
 from typing import cast, Dict
 
-from bs4 import BeautifulSoup
 from pdfrw import PdfReader, PdfWriter
 
 from config import HelperType
 from organization import Organization
 from server.templating import Templating
-from utils import dirjoin, ita_weekday, replace_path_vars
+from utils import dirjoin, insert_table_row, ita_weekday, replace_path_vars
 
 
 class Holidays:
@@ -127,21 +126,12 @@ class Holidays:
         # Update the Holidays wiki page
         #
         page_path = params["holidays_page"]
-        page = phab.search_document_by_path(page_path, include_body=True)
-        if not page:
-            raise Exception(f"Wiki page not found {page_path}")
-        page_title = page["attachments"]["content"]["title"]
-        page_body = page["attachments"]["content"]["content"]["raw"]
-        soup = BeautifulSoup(page_body, "html.parser")
         date_str = date.strftime("%Y-%m-%d")
-        row = BeautifulSoup(
-            f"""<tr>
+        row = f"""<tr>
 <td>{date_str}</td>
 <td>{wiki_desc}</td>
 <td>[[ /F{file['id']} | Download ]]</td>
-</tr>""",
-            features="html.parser",
+</tr>"""
+        phab.edit_page(
+            page_path, lambda body: insert_table_row(body, row, after_header=True)
         )
-        tbody = soup.find_all("table")[0]
-        tbody.insert(2, row)
-        phab.update_page(page_path, page_title, str(soup))
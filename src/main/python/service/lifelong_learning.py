@@ -7,13 +7,11 @@
 
 from calendar import different_locale
 from datetime import datetime
-from typing import cast, Dict
-
-from bs4 import BeautifulSoup
+from typing import cast, Dict, Optional
 
 from config import HelperType
 from organization import Organization
-from utils import ita_weekday
+from utils import insert_table_row, ita_weekday
 
 
 class LifelongLearning:
@@ -39,10 +37,12 @@ class LifelongLearning:
         ending: datetime,
         notes: str,
         ticket_key: str,
+        documents: Optional[Dict[str, Optional[Dict]]] = None,
     ) -> str:
         """
         Check whether or not the detail page exists. If it doesn't exist,
-        create it.
+        create it. The documents already looked up by schedule() are reused
+        instead of searching them again.
         """
         params = cast(Dict[str, str], self.helper["parameters"])
         phab = self.org.phabricator()
@@ -50,8 +50,11 @@ class LifelongLearning:
         # Create or update the detail page
         #
         page_title = f"{title}{params['page_suffix']}"
-        page_url = phab.urlize(f"{params['path_prefix']}{beginning.year}/{title}")
-        page = phab.search_document_by_path(page_url)
+        page_url = self._detail_page_path(title, beginning)
+        parent_page_path = self._yearly_summary_path(beginning)
+        if documents is None:
+            documents = phab.search_documents_by_paths([page_url, parent_page_path])
+        page = documents.get(page_url)
         if not page:
             date_format = " %d %B %Y, %H.%M"
             with different_locale("it_IT"):  # type: ignore
@@ -74,29 +77,37 @@ La partecipazione all'evento vale {credits} credit{plural} formativ{plural}.
         ###
         year = beginning.year
         parent_page_title = f"{year}{params['page_suffix']}"
-        parent_page_path = f"{params['path_prefix']}{beginning.year}"
-        parent_page = phab.search_document_by_path(parent_page_path, include_body=True)
-        parent_page_body = parent_page["attachments"]["content"]["content"]["raw"]
-        soup = BeautifulSoup(parent_page_body, features="html.parser")
         with different_locale("it_IT"):  # type: ignore
             date_str = beginning.strftime("%Y-%m-%d")
-        row = BeautifulSoup(
-            f"""<tr>
+        row = f"""<tr>
 <td>{code}</td>
 <td>[[{page_url} | {title}]]</td>
 <td>{date_str}</td>
 <td>{location}</td>
 <td>{credits}</td>
 <td></td>
-</tr>""",
-            features="html.parser",
+</tr>"""
+        phab.edit_page(
+            parent_page_path,
+            lambda body: insert_table_row(body, row),
+            parent_page_title,
         )
-        tbody = soup.find_all("table")[0]
-        tbody.append(row)
-        phab.update_page(parent_page_path, parent_page_title, str(soup))
         return page
 
-    def _ensure_yearly_summary(self, beginning: datetime) -> str:
+    def _detail_page_path(self, title: str, beginning: datetime) -> str:
+        params = cast(Dict[str, str], self.helper["parameters"])
+        phab = self.org.phabricator()
+        return phab.urlize(f"{params['path_prefix']}{beginning.year}/{title}")
+
+    def _yearly_summary_path(self, beginning: datetime) -> str:
+        params = cast(Dict[str, str], self.helper["parameters"])
+        return f"{params['path_prefix']}{beginning.year}"
+
+    def _ensure_yearly_summary(
+        self,
+        beginning: datetime,
+        documents: Optional[Dict[str, Optional[Dict]]] = None,
+    ) -> str:
         """
         Checks whether the yearly summary page exists. If it doesn't
         exist, create it.
@@ -104,8 +115,11 @@ La partecipazione all'evento vale {credits} credit{plural} formativ{plural}.
         params = cast(Dict[str, str], self.helper["parameters"])
         phab = self.org.phabricator()
         year = beginning.year
-        yearly_summary_path = f"{params['path_prefix']}{year}"
-        yearly_summary_page = phab.search_document_by_path(yearly_summary_path)
+        yearly_summary_path = self._yearly_summary_path(beginning)
+        if documents is None:
+            yearly_summary_page = phab.search_document_by_path(yearly_summary_path)
+        else:
+            yearly_summary_page = documents.get(yearly_summary_path)
         if yearly_summary_page:
             return yearly_summary_page["phid"]
         yearly_summary_body = f"""
@@ -190,6 +204,7 @@ Ho letto queste cose:
 * **To:** {ending_str}
 * **Credits:** {credits}"""
         phab = self.org.phabricator()
+        page_url = self._detail_page_path(title, beginning)
         fields = {
             "issuetype_field_name": params["phabricator_issuetype_field"],
             "issuetype_field_value": params["phabricator_issuetype_value"],
@@ -201,10 +216,14 @@ Ho letto queste cose:
             "credits_field_value": credits,
             "language_field_name": params["phabricator_language_field"],
             "language_field_value": params["phabricator_language_value"],
+            "extra_fields": (
+                (params["phabricator_start_field"], int(beginning.timestamp())),
+                (params["phabricator_end_field"], int(ending.timestamp())),
+                (params["phabricator_wiki_field"], phab.wiki_url + page_url),
+            ),
         }
         result = phab.create_ticket(fields)
         ticket_key = "T" + result["id"]
-        ticket_phid = result["phid"]
         #
         # Create the calendar event
         #
@@ -213,10 +232,13 @@ Ho letto queste cose:
         calendar_location = cal.filter_text(location)
         cal.add_event(calendar_summary, calendar_location, beginning, ending, "-PT1H")
         #
-        # Create the Phriction pages
+        # Create the Phriction pages, looking them up with a single search
         #
-        self._ensure_yearly_summary(beginning)
-        page = self._ensure_detail_page(
+        documents = phab.search_documents_by_paths(
+            [self._yearly_summary_path(beginning), page_url]
+        )
+        self._ensure_yearly_summary(beginning, documents)
+        self._ensure_detail_page(
             code,
             title,
             location,
@@ -225,15 +247,5 @@ Ho letto queste cose:
             ending,
             notes,
             ticket_key,
-        )
-        #
-        # Update the Maniphest ticket wiki URL
-        #
-        phab.update_ticket_fields(
-            ticket_phid,
-            (
-                (params["phabricator_wiki_field"], phab.wiki_url + page["slug"]),  # noqa
-                (params["phabricator_start_field"], int(beginning.timestamp())),
-                (params["phabricator_end_field"], int(ending.timestamp())),
-            ),
+            documents,
         )
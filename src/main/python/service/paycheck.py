@@ -49,19 +49,16 @@ class Paycheck:
             #
             wiki_file_name = dirjoin(params["paycheck_dir"], file_name)
             #shutil.copyfile(pdf, wiki_file_name)
-            self.org.ftp().host.upload(pdf, wiki_file_name)
+            self.org.storage().upload(pdf, wiki_file_name, skip_unchanged=True)
         #
         # Update the specific bill wiki page
         #
             with change_locale("de_DE"):
                 gross_str = locale.format_string("%.2f", gross)
                 net_str = locale.format_string("%.2f", net)
-            with self.org.ftp().host.open(params["paycheck_file"], encoding="utf-8") as f:
-                lines = [l.strip() for l in f.readlines()]
-            index = lines.index(params["paycheck_heading"])
             if notes:
                 day_str = f"{day_str} ({notes})"
             newline = f"|{day_str}|€ {gross_str}|€ {net_str}| {{{{ {params['paycheck_prefix'] + file_name}'?linkonly|Download}}}} |"
-            lines.insert(index + 1, newline)
-            with self.org.ftp().host.open(params["paycheck_file"], "w", encoding="utf-8") as f:
-                f.write("\n".join(lines))
\ No newline at end of file
+            self.org.storage().insert_line(
+                params["paycheck_file"], params["paycheck_heading"], newline
+            )
\ No newline at end of file
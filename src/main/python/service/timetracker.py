@@ -7,14 +7,38 @@
 
 from datetime import datetime
 
-from typing import cast, Dict, List, Optional
+from typing import cast, Dict, Iterator, List, Optional, TextIO
 
+from jinja2 import Environment
 from PyQt5 import QtCore
 
 from config import HelperType
 from organization import Organization
 from server.jira import Worklog
 
+WORKLOGS_TEMPLATE = Environment(autoescape=True).from_string(
+    """<body>
+{%- for username, worklogs, total_h in reports -%}
+{% if not loop.first %}<hr>{% endif -%}
+<br><h1>{{ username }}</h1><br>
+<table border="1" style="font-size: 12px">
+<tr><th>Issue</th><th>Summary</th><th>Time</th><th>Author</th><th>Started</th><th>Comment</th></tr>
+{% for worklog in worklogs -%}
+<tr>
+<td style="padding: 5px">{{ worklog.ticket }}</td>
+<td style="padding: 5px">{{ worklog.summary }}</td>
+<td style="padding: 5px; text-align: right">{{ worklog.duration }}</td>
+<td style="padding: 5px">{{ worklog.author }}</td>
+<td style="padding: 5px">{{ worklog.started.strftime("%H:%M") }}</td>
+<td style="padding: 5px">{{ worklog.description }}</td>
+</tr>
+{% endfor -%}
+</table>
+<br><h4 style="font-size: 16px">Total hours: {{ total_h }}</h4><br>
+{%- endfor %}
+</body>"""
+)
+
 
 class Timetracker:
     org: Organization
@@ -28,37 +52,38 @@ class Timetracker:
         worklogs_by_user: Dict[str, List[Worklog]],
         users: Optional[List[str]] = None,
     ) -> str:
+        return "".join(self.iter_worklogs_html(worklogs_by_user, users))
+
+    def write_worklogs_html(
+        self,
+        out: TextIO,
+        worklogs_by_user: Dict[str, List[Worklog]],
+        users: Optional[List[str]] = None,
+    ):
+        """
+        Stream the worklogs report to a file-like object, one chunk at a time.
+        """
+        for chunk in self.iter_worklogs_html(worklogs_by_user, users):
+            out.write(chunk)
+
+    def iter_worklogs_html(
+        self,
+        worklogs_by_user: Dict[str, List[Worklog]],
+        users: Optional[List[str]] = None,
+    ) -> Iterator[str]:
+        """
+        Render the worklogs report as a sequence of HTML chunks. Worklog fields
+        are escaped and the per-user totals are computed before rendering.
+        """
         params = cast(Dict[str, str], self.helper["parameters"])
-        html = "<body>"
         if not users:
             users = params["jira_users"].split(",")
-        for i, username in enumerate(users):
-            if i > 0:
-                html += "<hr>"
-            total_h = 0.0
-            html += "<br><h1>{}</h1><br>".format(username)
-            html += '<table border="1" style="font-size: 12px">'
-            html += "<tr><th>Issue</th><th>Summary</th><th>Time</th><th>Author</th><th>Started</th><th>Comment</th></tr>"
-            worklogs = worklogs_by_user[username]
-            for worklog in sorted(worklogs, key=lambda w: w.started):
-                total_h += worklog.duration
-                html += "<tr>"
-                html += f'<td style="padding: 5px">{worklog.ticket}</td>'
-                html += f'<td style="padding: 5px">{worklog.summary}</td>'
-                html += f'<td style="padding: 5px; text-align: right">{worklog.duration}</td>'
-                html += f'<td style="padding: 5px">{worklog.author}</td>'
-                html += (
-                    f'<td style="padding: 5px">{worklog.started.strftime("%H:%M")}</td>'
-                )
-                # started.replace(".000+0000", "").replace("T", " ") + " UTC"
-                html += '<td style="padding: 5px">{}</td>'.format(worklog.description)
-                html += "</tr>\n"
-            html += "</table>"
-            html += '<br><h4 style="font-size: 16px">Total hours: {}</h4><br>'.format(
-                total_h
-            )
-        html += "</body>"
-        return html
+        reports = []
+        for username in users:
+            worklogs = sorted(worklogs_by_user[username], key=lambda w: w.started)
+            total_h = sum((worklog.duration for worklog in worklogs), 0.0)
+            reports.append((username, worklogs, total_h))
+        return WORKLOGS_TEMPLATE.generate(reports=reports)
 
     def get_worklogs(
         self,
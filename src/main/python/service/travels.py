@@ -7,12 +7,12 @@
 
 from calendar import different_locale, month_name
 from datetime import datetime
-import os
 import re
 from typing import cast, Dict
 
 from config import HelperType
 from organization import Organization
+from server.storage import LocalStorage
 from utils import dirjoin
 
 
@@ -46,35 +46,29 @@ class Travels:
         sanitized_destination = re.sub(r"[^a-zA-Z]", "_", destination).lower()
         dir_name = f"{sanitized_destination}_{year}_{month:02d}"
         params = cast(Dict[str, str], self.helper["parameters"])
-        media_dir = dirjoin(params["travels_dir"], dir_name)
-        if not os.path.exists(media_dir):
-            os.makedirs(media_dir)
-            pass
+        # Travels always used local paths: the storage of the organization
+        # is used only when server_storage is configured
+        if self.org.storage_explicit:
+            storage = self.org.storage()
         else:
-            i = 2
-            while True:
-                new_dir_name = f"{dir_name}_{i}"
-                media_dir = dirjoin(params["travels_dir"], new_dir_name)
-                if not os.path.exists(media_dir):
-                    os.makedirs(media_dir)
-                    dir_name = new_dir_name
-                    break
+            storage = LocalStorage()
+        media_dir = dirjoin(params["travels_dir"], dir_name)
+        i = 2
+        while storage.exists(media_dir):
+            new_dir_name = f"{dir_name}_{i}"
+            media_dir = dirjoin(params["travels_dir"], new_dir_name)
+            i += 1
+        if i > 2:
+            dir_name = new_dir_name
+        storage.makedirs(media_dir)
         #
         # Update the travel summary page
         #
-        with open(params["travels_file"]) as f:
-            lines = f.readlines()
-        index = lines.index(params["travels_heading"])
-        print(index)
-        print(month_str)
         link = params['travels_prefix'] + dir_name
         newline = f"| [[{link}|{month_str}]] | [[{link}|{destination}]] | {description} |\n"
-        lines.insert(index + 1, newline)
-        with open(params["travels_file"], "w") as f:
-            f.writelines(lines)
+        storage.insert_line(params["travels_file"], params["travels_heading"], newline)
         #
         # Create the travel page
         #
         page_file = dirjoin(params["travels_page_dir"], f"{dir_name}.txt")
-        with open(page_file, "w") as pf:
-            pf.write(f"====== {page_title} ======\n\nTBD\n")
\ No newline at end of file
+        storage.write_text(page_file, f"====== {page_title} ======\n\nTBD\n")
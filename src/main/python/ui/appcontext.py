@@ -32,6 +32,7 @@ from ui.letsencrypt import LetsEncryptUI  # noqa: F401
 from ui.bills import BillsUI  # noqa: F401
 from ui.clockings import ClockingsUI  # noqa: F401
 from ui.holidays import HolidayUI  # noqa: F401
+from ui.mail_queue import MailQueueUI  # noqa: F401
 from ui.paycheck import PaycheckUI  # noqa: F401
 from ui.pregnancy import PregnancyUI  # noqa: F401
 from ui.phabricator_files import PhabricatorFilesUI  # noqa: F401
@@ -78,6 +79,7 @@ class AppContext(AbstractContext):
             )
             gb.setLayout(vbox)
             self.groupboxes.append(gb)
+            org.resume_mail_queue()
         self.status_bar = self.window.findChild(QStatusBar, "statusbar")
         self.action_about = self.window.findChild(QAction, "actionAbout")
         self.action_about.triggered.connect(self.action_about_triggered)
@@ -0,0 +1,135 @@
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+# -*- coding: utf-8 -*-
+"""
+:copyright: (c) 2020 Paolo Bernardi.
+:license: GNU AGPL version 3, see LICENSE for more details.
+"""
+
+from datetime import datetime
+from typing import List, Optional
+
+from PyQt5 import QtCore, uic
+from PyQt5.QtWidgets import (
+    QHeaderView,
+    QPushButton,
+    QTableWidget,
+    QTableWidgetItem,
+    QWidget,
+    QApplication,
+)
+
+from config import HelperType
+from organization import Organization
+from server.mailqueue import MailQueue
+from ui.abstractcontext import AbstractContext
+from ui.abstractui import AbstractUI
+
+
+class MailQueueUI(AbstractUI):
+    """
+    Status of the outbound mail queue, refreshed while it's shown.
+    """
+
+    context: AbstractContext
+    organization: Organization
+    helper: HelperType
+    _widget: Optional[QWidget]
+    tw_messages: QTableWidget
+    pb_retry: QPushButton
+    pb_remove: QPushButton
+    pb_clear_sent: QPushButton
+    pb_close: QPushButton
+    timer: QtCore.QTimer
+    message_ids: List[int]
+
+    REFRESH_MS = 2000
+
+    def __init__(
+        self,
+        context: AbstractContext,
+        organization: Organization,
+        helper: HelperType,
+        qapp: QApplication,
+    ):
+        super().__init__(qapp, context)
+        self.context = context
+        self.organization = organization
+        self.helper = helper
+        self._widget = None
+        self.message_ids = []
+
+    def widget(self) -> QWidget:
+        if not self._widget:
+            self._widget = uic.loadUi(self.context.get_resource("ui/mail_queue.ui"))
+            self.tw_messages = self._widget.findChild(QTableWidget, "twMessages")
+            header = self.tw_messages.horizontalHeader()
+            header.setSectionResizeMode(QHeaderView.ResizeToContents)
+            header.setSectionResizeMode(2, QHeaderView.Stretch)
+            self.pb_retry = self._widget.findChild(QPushButton, "pbRetry")
+            self.pb_retry.clicked.connect(self.pb_retry_clicked)
+            self.pb_remove = self._widget.findChild(QPushButton, "pbRemove")
+            self.pb_remove.clicked.connect(self.pb_remove_clicked)
+            self.pb_clear_sent = self._widget.findChild(QPushButton, "pbClearSent")
+            self.pb_clear_sent.clicked.connect(self.pb_clear_sent_clicked)
+            self.pb_close = self._widget.findChild(QPushButton, "pbClose")
+            self.pb_close.clicked.connect(self.pb_close_clicked)
+            self.timer = QtCore.QTimer(self._widget)
+            self.timer.timeout.connect(self.timer_timeout)
+            self.timer.start(self.REFRESH_MS)
+            self.refresh()
+        return self._widget
+
+    def queue(self) -> MailQueue:
+        return self.organization.mail_queue()
+
+    def timer_timeout(self):
+        if self._widget.isVisible():
+            self.refresh()
+
+    def refresh(self):
+        entries = self.queue().status()
+        self.message_ids = [e["id"] for e in entries]
+        self.tw_messages.setRowCount(len(entries))
+        for row, entry in enumerate(entries):
+            next_attempt = ""
+            if entry["status"] == MailQueue.QUEUED:
+                next_attempt = self.format_time(entry["next_attempt"])
+            values = [
+                self.format_time(entry["created"]),
+                ", ".join(entry["to"]),
+                entry["subject"],
+                entry["status"],
+                str(entry["attempts"]),
+                next_attempt,
+                entry["last_error"] or "",
+            ]
+            for column, value in enumerate(values):
+                self.tw_messages.setItem(row, column, QTableWidgetItem(value))
+
+    def format_time(self, timestamp: float) -> str:
+        return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+    def selected_id(self) -> Optional[int]:
+        rows = self.tw_messages.selectionModel().selectedRows()
+        if not rows:
+            self.message_error("Please select a message")
+            return None
+        return self.message_ids[rows[0].row()]
+
+    def pb_retry_clicked(self):
+        message_id = self.selected_id()
+        if message_id is not None:
+            self.queue().retry(message_id)
+            self.refresh()
+
+    def pb_remove_clicked(self):
+        message_id = self.selected_id()
+        if message_id is not None and self.message_yes_no(
+            "Do you really want to remove the selected message from the queue?"
+        ):
+            self.queue().remove(message_id)
+            self.refresh()
+
+    def pb_clear_sent_clicked(self):
+        self.queue().clear_sent()
+        self.refresh()
@@ -6,24 +6,31 @@
 """
 
 from calendar import month_name
+from concurrent.futures import as_completed, ThreadPoolExecutor
 import logging
 import os
+import time
 import traceback
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 from urllib.parse import urlparse
 
 from PyQt5 import QtCore, uic
 from PyQt5.QtWidgets import (
+    QHeaderView,
+    QLabel,
     QLineEdit,
     QPushButton,
     QProgressBar,
     QFileDialog,
+    QTableWidget,
+    QTableWidgetItem,
     QWidget,
     QApplication,
 )
 
 from config import HelperType
 from organization import Organization
+from server.phabricator import UploadJournal
 from ui.abstractcontext import AbstractContext
 from ui.abstractui import AbstractUI
 from ui.basetask import BaseTask
@@ -35,16 +42,26 @@ class PhabricatorFilesUI(AbstractUI):
     helper: HelperType
     _widget: Optional[QWidget]
     pb_file: QPushButton
+    pb_directory: QPushButton
     le_name: QLineEdit
     pb_upload: QPushButton
     pbar_upload: QProgressBar
+    lb_throughput: QLabel
     le_file_id: QLineEdit
+    tw_files: QTableWidget
     pb_close: QPushButton
     message = QtCore.pyqtSignal(str)
-    signal_progress = QtCore.pyqtSignal(int, int)
-    signal_success = QtCore.pyqtSignal()
+    signal_file_progress = QtCore.pyqtSignal(int, int, int)
+    signal_file_done = QtCore.pyqtSignal(int, str)
+    signal_success = QtCore.pyqtSignal(str)
     signal_failure = QtCore.pyqtSignal(str)
     last_open_dir: str = os.path.expanduser("~")
+    journal: UploadJournal
+    files: List[str]
+    name_prefix: str
+    file_sizes: List[int]
+    file_progress: Dict[int, float]
+    upload_start: float
 
     def __init__(
         self,
@@ -58,51 +75,104 @@ class PhabricatorFilesUI(AbstractUI):
         self.organization = organization
         self.helper = helper
         self._widget = None
-        self.file = None
+        self.files = []
+        self.name_prefix = ""
+        self.file_sizes = []
+        self.file_progress = {}
+        self.upload_start = 0.0
+        self.journal = UploadJournal(
+            os.path.join(os.path.expanduser("~"), ".photocopieuse-uploads.json")
+        )
 
     def widget(self) -> QWidget:
         if not self._widget:
             self._widget = uic.loadUi(self.context.get_resource("ui/phabricator_files.ui"))
             self.pb_file = self._widget.findChild(QPushButton, "pbFile")
             self.pb_file.clicked.connect(self.pb_file_clicked)
+            self.pb_directory = self._widget.findChild(QPushButton, "pbDirectory")
+            self.pb_directory.clicked.connect(self.pb_directory_clicked)
             self.le_name = self._widget.findChild(QLineEdit, "leName")
             clipboard = QApplication.clipboard().text()
             if clipboard:
                 path = urlparse(clipboard).path
                 if path.startswith("/w/"):
-                    self.le_name.setText(path[3:])
+                    self.name_prefix = path[3:]
+                    self.le_name.setText(self.name_prefix)
             self.pbar_upload = self._widget.findChild(QProgressBar, "pbarUpload")
+            self.lb_throughput = self._widget.findChild(QLabel, "lbThroughput")
             self.le_file_id = self._widget.findChild(QLineEdit, "leFileId")
+            self.tw_files = self._widget.findChild(QTableWidget, "twFiles")
+            header = self.tw_files.horizontalHeader()
+            header.setSectionResizeMode(0, QHeaderView.Stretch)
+            header.setSectionResizeMode(2, QHeaderView.ResizeToContents)
             self.pb_close = self._widget.findChild(QPushButton, "pbClose")
             self.pb_close.clicked.connect(self.pb_close_clicked)
             self.pb_upload = self._widget.findChild(QPushButton, "pbUpload")
             self.pb_upload.clicked.connect(self.pb_upload_clicked)
             self.signal_success.connect(self.success)
             self.signal_failure.connect(self.failure)
-            self.signal_progress.connect(self.show_progress)
+            self.signal_file_progress.connect(self.show_file_progress)
+            self.signal_file_done.connect(self.show_file_done)
         return self._widget
 
     def active(self, state):
         self.pb_file.setEnabled(state)
+        self.pb_directory.setEnabled(state)
         self.le_name.setEnabled(state)
         self.pbar_upload.setEnabled(state)
-        self.le_name.setEnabled(state)
         self.pb_upload.setEnabled(state)
         self.pb_close.setEnabled(state)
-    
+
     def pb_file_clicked(self):
-        file = QFileDialog.getOpenFileName(
-            self._widget, "Open file", self.last_open_dir, "Any file (*.*)"
+        files = QFileDialog.getOpenFileNames(
+            self._widget, "Open files", self.last_open_dir, "Any file (*.*)"
         )[0]
-        if file:
-            self.file = file
-            base_name = os.path.basename(file).replace("/", "-")
-            self.pb_file.setText(base_name)
-            self.le_name.setText((self.le_name.text() + base_name).strip())
-            self.last_open_dir = os.path.realpath(os.path.dirname(file))
+        if files:
+            self.last_open_dir = os.path.realpath(os.path.dirname(files[0]))
+            self.set_files(files)
+
+    def pb_directory_clicked(self):
+        directory = QFileDialog.getExistingDirectory(
+            self._widget, "Open folder", self.last_open_dir
+        )
+        if directory:
+            files = [
+                os.path.join(directory, f)
+                for f in sorted(os.listdir(directory))
+                if os.path.isfile(os.path.join(directory, f))
+            ]
+            if not files:
+                self.message_error("The selected folder doesn't contain any file")
+                return
+            self.last_open_dir = os.path.realpath(directory)
+            self.set_files(files)
+
+    def set_files(self, files: List[str]):
+        """
+        Replace the upload queue. With a single file the remote name can be
+        edited as a whole, with many files it's the prefix of their names.
+        """
+        self.files = files
+        base_names = [self.base_name(f) for f in files]
+        if len(files) == 1:
+            self.pb_file.setText(base_names[0])
+            self.le_name.setText((self.name_prefix + base_names[0]).strip())
+        else:
+            self.pb_file.setText(f"{len(files)} files")
+            self.le_name.setText(self.name_prefix)
+        self.tw_files.setRowCount(len(files))
+        for row, base_name in enumerate(base_names):
+            self.tw_files.setItem(row, 0, QTableWidgetItem(base_name))
+            pbar = QProgressBar()
+            pbar.setValue(0)
+            self.tw_files.setCellWidget(row, 1, pbar)
+            self.tw_files.setItem(row, 2, QTableWidgetItem(""))
+
+    def base_name(self, file: str) -> str:
+        return os.path.basename(file).replace("/", "-")
 
     def pb_upload_clicked(self):
-        if not self.file:
+        if not self.files:
             self.message_error("Please select a file")
             return
         try:
@@ -113,44 +183,133 @@ class PhabricatorFilesUI(AbstractUI):
             logging.error(e)
             self.message_error("Please specify a Phabricator name for the file")
             return
+        if len(self.files) == 1:
+            uploads = [(self.files[0], name)]
+        else:
+            uploads = [(f, name + self.base_name(f)) for f in self.files]
+        try:
+            file_sizes = [os.path.getsize(f) for f in self.files]
+            resuming = any(self.journal.resumable(f, os.stat(f)) for f in self.files)
+        except OSError as e:
+            self.message_error(f"Unable to read the selected files: {e}")
+            return
         self.active(False)
-        self.context.show_status("File upload in progress...")
-        PhabricatorFilesTask(self, name).start()
+        self.file_sizes = file_sizes
+        self.file_progress = {}
+        self.upload_start = time.monotonic()
+        self.le_file_id.clear()
+        for row in range(len(self.files)):
+            self.show_file_progress(row, 0, 100)
+            self.tw_files.item(row, 2).setText("")
+        if resuming:
+            self.context.show_status("Resuming interrupted file uploads...")
+        else:
+            self.context.show_status("File upload in progress...")
+        PhabricatorFilesTask(self, uploads).start()
 
     def failure(self, message: str):
         self.message_error(message)
         self.context.clear_status()
         self.active(True)
 
-    def success(self):
+    def success(self, file_ids: str):
+        self.le_file_id.setText(file_ids)
         self.le_file_id.selectAll()
         clipboard = QApplication.clipboard()
-        clipboard.setText(self.le_file_id.text())
+        clipboard.setText(file_ids)
         self.context.clear_status()
         self.active(True)
-        self.message_info("The file was uploaded correctly and the file ID was copied to the clipboard.")
-    
-    def show_progress(self, value: int, max_value: int):
-        self.pbar_upload.setValue(value)
-        self.pbar_upload.setMaximum(max_value)
+        if len(self.files) == 1:
+            self.message_info("The file was uploaded correctly and the file ID was copied to the clipboard.")
+        else:
+            self.message_info("The files were uploaded correctly and their IDs were copied to the clipboard.")
+
+    def show_file_progress(self, row: int, value: int, max_value: int):
+        pbar = self.tw_files.cellWidget(row, 1)
+        pbar.setMaximum(max_value)
+        pbar.setValue(value)
+        self.file_progress[row] = value / max_value if max_value else 0.0
+        total = sum(self.file_sizes)
+        sent = sum(self.file_sizes[r] * p for r, p in self.file_progress.items())
+        self.pbar_upload.setMaximum(1000)
+        self.pbar_upload.setValue(int(sent * 1000 / total) if total else 0)
+        elapsed = time.monotonic() - self.upload_start
+        if elapsed > 0:
+            completed = sum(1 for p in self.file_progress.values() if p >= 1)
+            self.lb_throughput.setText(
+                f"{sent / elapsed / 1024 / 1024:.2f} MiB/s, "
+                f"{completed} of {len(self.file_sizes)} files"
+            )
+
+    def show_file_done(self, row: int, result: str):
+        self.tw_files.item(row, 2).setText(result)
+
+
+class FileProgress:
+    """
+    Progress signal of a single file of the upload queue (a
+    server.phabricator.ProgressSignal).
+    """
+
+    def __init__(self, signal: QtCore.pyqtBoundSignal, row: int):
+        self.signal = signal
+        self.row = row
+
+    def emit(self, value: int, max_value: int):
+        self.signal.emit(self.row, value, max_value)
 
 
 class PhabricatorFilesTask(BaseTask):
     ui: PhabricatorFilesUI
-    name: str
+    uploads: List[Tuple[str, str]]
+
+    # Files uploaded at the same time; the chunk workers are split among them
+    FILE_WORKERS = 3
 
-    def __init__(self, ui: PhabricatorFilesUI, name: str):
+    def __init__(self, ui: PhabricatorFilesUI, uploads: List[Tuple[str, str]]):
         super().__init__()
         self.ui = ui
-        self.name = name
+        self.uploads = uploads
+
+    def upload(self, row: int, file: str, name: str) -> str:
+        phab = self.ui.organization.phabricator()
+        workers = max(1, phab.upload_workers // min(self.FILE_WORKERS, len(self.uploads)))
+        phid = phab.upload_file(
+            file,
+            name,
+            FileProgress(self.ui.signal_file_progress, row),
+            workers,
+            self.ui.journal,
+        )
+        phab_file = phab.get_file_by_phid(phid)
+        return f"F{phab_file['id']}"
 
     def run(self):
         try:
-            phab = self.ui.organization.phabricator()
-            phid = phab.upload_file(self.ui.file, self.name, self.ui.signal_progress)
-            file = phab.get_file_by_phid(phid)
-            file_id = f"F{file['id']}"
-            self.ui.le_file_id.setText(file_id)
-            self.ui.signal_success.emit()
+            file_ids: Dict[int, str] = {}
+            failures = []
+            with ThreadPoolExecutor(max_workers=self.FILE_WORKERS) as executor:
+                futures = {
+                    executor.submit(self.upload, row, file, name): row
+                    for row, (file, name) in enumerate(self.uploads)
+                }
+                for future in as_completed(futures):
+                    row = futures[future]
+                    try:
+                        file_ids[row] = future.result()
+                        self.ui.signal_file_done.emit(row, file_ids[row])
+                    except Exception:
+                        logging.error(traceback.format_exc())
+                        failures.append(
+                            f"{self.uploads[row][0]}: {traceback.format_exc(limit=1)}"
+                        )
+                        self.ui.signal_file_done.emit(row, "Failed")
+            ids = " ".join(file_ids[row] for row in sorted(file_ids))
+            if failures:
+                self.ui.signal_failure.emit(
+                    f"Uploaded: {ids or 'none'}\n\nFailed:\n" + "\n".join(failures)
+                )
+            else:
+                self.ui.signal_success.emit(ids)
         except Exception:
             self.ui.signal_failure.emit(traceback.format_exc())
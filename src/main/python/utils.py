@@ -8,7 +8,9 @@
 from datetime import datetime
 import hashlib
 import locale as _locale
+import mmap
 import os
+import re
 import subprocess
 from tempfile import mktemp
 from typing import List
@@ -83,9 +85,49 @@ def dirjoin(dir1: str, dir2: str):
     return dir1 + dir2
 
 
-def sha256(path: str):
+def sha256(path: str) -> str:
+    """
+    SHA-256 hex digest of a file (the contentHash expected by Phabricator),
+    computed over a memory map of the file in a single pass.
+    """
+    file_hash = hashlib.sha256()
     with open(path, "rb") as f:
-        file_hash = hashlib.md5()
-        while chunk := f.read(8192):
-            file_hash.update(chunk)
+        if os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                file_hash.update(mm)
     return file_hash.hexdigest()
+
+
+TABLE_TAGS = re.compile(r"<(/?)table(?:\s[^>]*)?>|</tr\s*>", re.IGNORECASE)
+
+
+def insert_table_row(html: str, row: str, after_header: bool = False) -> str:
+    """
+    Insert a row in the first table of an HTML text, either at its end or
+    right after its first row, without reparsing the text: everything but
+    the inserted row is left untouched.
+    """
+    start = None
+    first_row_end = None
+    depth = 0
+    for tag in TABLE_TAGS.finditer(html):
+        if tag.group(1) is None:  # </tr>
+            if depth == 1 and first_row_end is None:
+                first_row_end = tag.end()
+        elif tag.group(1):  # </table>
+            if depth == 1:
+                break
+            depth = max(depth - 1, 0)
+        else:  # <table>
+            if start is None:
+                start = tag
+            depth += 1
+    else:
+        raise ValueError("No table found" if start is None else "Unterminated table")
+    assert start is not None
+    if after_header:
+        pos = first_row_end if first_row_end is not None else start.end()
+        return html[:pos] + "\n" + row + html[pos:]
+    pos = tag.start()
+    prefix = "" if html[:pos].endswith("\n") else "\n"
+    return html[:pos] + prefix + row + "\n" + html[pos:]